@@ -0,0 +1,308 @@
+import time
+import tracemalloc
+import random
+
+from distance import distanceMatrix
+from facilitylocation import FacilityLocationModel
+from heuristicsolver import solvers
+from tsp import TSP
+
+
+def syntheticData(ncustomers=7000, nsites=13, nperiods=6,
+maxopensites=4, seed=0):
+	"""
+	Function to create random input data for
+	FacilityLocationModel of roughly same shape
+	as case study (customers spread over a city,
+	demand growing every period).
+	args:
+		ncustomers: int
+		nsites: int
+		nperiods: int
+		maxopensites: int
+		seed: int
+			Seed for random generator
+	return:
+		data: dictionary
+			Data in format expected by
+			FacilityLocationModel
+		coordinates: dictionary
+			Latitude and longitude by location id
+	"""
+	rnd = random.Random(seed)
+
+	periodid = [2020 + p for p in range(nperiods)]
+	siteid = [f"S-{i+1}" for i in range(nsites)]
+	customerid = [1000 + j for j in range(ncustomers)]
+
+	coordinates = {
+		locid: (41.88 + rnd.uniform(-0.3, 0.3),
+			-87.63 + rnd.uniform(-0.3, 0.3))
+		for locid in siteid + customerid
+	}
+
+	basedemand = {cid: rnd.uniform(1, 10) for cid in customerid}
+	customerdembyperiod = {
+		pid: {cid: round(basedemand[cid] * 1.1**p, 2)
+			for cid in customerid}
+		for p, pid in enumerate(periodid)
+	}
+
+	sitecapbyperiod = {}
+	siteslackcapbyperiod = {}
+	for pid in periodid:
+		totaldemand = sum(customerdembyperiod[pid].values())
+		sitecapbyperiod[pid] = {
+			sid: round(totaldemand / maxopensites, 2)
+			for sid in siteid}
+		siteslackcapbyperiod[pid] = {
+			sid: round(0.2 * totaldemand / maxopensites, 2)
+			for sid in siteid}
+
+	matrix = distanceMatrix(
+		[coordinates[sid][0] for sid in siteid],
+		[coordinates[sid][1] for sid in siteid],
+		[coordinates[cid][0] for cid in customerid],
+		[coordinates[cid][1] for cid in customerid])
+	servicedist = dict(zip(
+		[(sid, cid) for sid in siteid for cid in customerid],
+		matrix.ravel().tolist()))
+
+	data = {
+		'periodid': periodid,
+		'siteid': siteid,
+		'customerid': customerid,
+		'sitecapbyperiod': sitecapbyperiod,
+		'siteslackcapbyperiod': siteslackcapbyperiod,
+		'customerdembyperiod': customerdembyperiod,
+		'servicedist': servicedist,
+		'maxopensites': maxopensites
+	}
+	return data, coordinates
+
+
+def measure(func, *args, **kwargs):
+	"""
+	Function to call func and return its result
+	with wall time (seconds) and peak python
+	memory (MB) allocated during the call.
+	"""
+	tracemalloc.start()
+	start = time.time()
+	result = func(*args, **kwargs)
+	delta = time.time() - start
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return result, delta, peak / 1024**2
+
+
+def modelStats(flm):
+	"""
+	Function to return size and Gurobi memory
+	usage of a built model.
+	"""
+	flm.model.update()
+	stats = {
+		'vars': flm.model.NumVars,
+		'constrs': flm.model.NumConstrs,
+		'genconstrs': flm.model.NumGenConstrs,
+	}
+	try:
+		# Gurobi 10+, in GB
+		stats['grbmemgb'] = flm.model.MaxMemUsed
+	except AttributeError:
+		pass
+	return stats
+
+
+def benchmarkModelBuild(data):
+	"""
+	Function to compare build time and peak memory
+	of expression based and matrix API based
+	model building.
+	"""
+	for matrixapi in [False, True]:
+		flm = FacilityLocationModel(data)
+		_, delta, peak = measure(
+			flm.modelProblem, matrixapi=matrixapi)
+		stats = modelStats(flm)
+		print(f"matrixapi={matrixapi}: built in {delta:.2f}s, " +\
+			f"peak python memory {peak:.1f}MB, {stats}")
+		flm.model.dispose()
+
+
+def benchmarkCandidateArcs(data, k=3, radius=None):
+	"""
+	Function to compare model size and solve time
+	of full model with model restricted to candidate
+	arcs (priced back in by solveModel).
+	"""
+	for candidate in [False, True]:
+		flm = FacilityLocationModel(data)
+		if candidate:
+			flm.setCandidateArcs(k, radius)
+		flm.modelProblem(matrixapi=True)
+		stats = modelStats(flm)
+		flm.setParameters()
+		_, delta, _ = measure(flm.solveModel)
+		print(f"candidatearcs={candidate}: {stats}, " +\
+			f"arcs {int(flm.arcmask.sum())}, " +\
+			f"solved in {delta:.2f}s, objective {flm.model.ObjVal:.2f}")
+		flm.model.dispose()
+
+
+def benchmarkFormulations(data, timelimit=600):
+	"""
+	Function to compare build time, model size and
+	solve time of indicator and big-M formulations.
+	"""
+	for formulation, strengthen in [('indicator', False), 
+	('bigm', False), ('bigm', True)]:
+		flm = FacilityLocationModel(data)
+		_, builddelta, peak = measure(flm.modelProblem, matrixapi=True,
+			formulation=formulation, strengthen=strengthen)
+		flm.setParameters()
+		flm.model.setParam('TimeLimit', timelimit)
+		_, solvedelta, _ = measure(flm.solveModel)
+		print(f"{formulation} (strengthen={strengthen}): " +\
+			f"built in {builddelta:.2f}s, peak python memory " +\
+			f"{peak:.1f}MB, solved in {solvedelta:.2f}s, " +\
+			f"objective {flm.model.ObjVal:.2f}, " +\
+			f"gap {flm.model.MIPGap:.4f}, {modelStats(flm)}")
+		flm.model.dispose()
+
+
+def benchmarkSolvers(data, names=['gurobi', 'highs', 'lagrangian'],
+timelimit=600):
+	"""
+	Function to compare solve time, objective and
+	lower bound of Gurobi and license free solvers.
+	"""
+	for name in names:
+		flm = solvers[name](data)
+		_, builddelta, _ = measure(flm.modelProblem, formulation='bigm')
+		if name == 'gurobi':
+			flm.setParameters()
+			flm.model.setParam('TimeLimit', timelimit)
+		else:
+			flm.setParameters(timelimit=timelimit)
+		_, solvedelta, _ = measure(flm.solveModel)
+
+		if name == 'gurobi':
+			objective = flm.model.ObjVal
+			lowerbound = flm.model.ObjBound
+			flm.model.dispose()
+		else:
+			objective = flm.objective
+			lowerbound = flm.lowerbound
+		print(f"{name}: built in {builddelta:.2f}s, solved in " +\
+			f"{solvedelta:.2f}s, objective {objective}, " +\
+			f"lower bound {lowerbound}")
+
+
+def benchmarkScenarioResolve(data, scenarios=5, seed=0):
+	"""
+	Function to compare running what-if scenarios 
+	(random site capacity changes) by rebuilding model
+	against changing built model in place and
+	reoptimizing from previous solution. Base solve
+	of in place run is timed separately.
+	"""
+	rnd = random.Random(seed)
+	changes = [
+		[(pid, sid, data['sitecapbyperiod'][pid][sid] * rnd.uniform(0.8, 1.2))
+			for pid in data['periodid'] for sid in data['siteid']]
+		for _ in range(scenarios)
+	]
+
+	start = time.time()
+	for scenario in changes:
+		sitecapbyperiod = {pid: dict(caps)
+			for pid, caps in data['sitecapbyperiod'].items()}
+		for pid, sid, capacity in scenario:
+			sitecapbyperiod[pid][sid] = capacity
+		flm = FacilityLocationModel(
+			{**data, 'sitecapbyperiod': sitecapbyperiod})
+		flm.modelProblem(matrixapi=True, formulation='bigm')
+		flm.setParameters()
+		flm.solveModel()
+		flm.model.dispose()
+	print(f"rebuild: {scenarios} scenarios in {time.time() - start:.2f}s")
+
+	start = time.time()
+	flm = FacilityLocationModel(data)
+	flm.modelProblem(matrixapi=True, formulation='bigm')
+	flm.setParameters()
+	flm.solveModel()
+	print(f"in place: base solve in {time.time() - start:.2f}s")
+
+	start = time.time()
+	for scenario in changes:
+		for pid, sid, capacity in scenario:
+			flm.setCapacity(pid, sid, capacity)
+		flm.reoptimize()
+	print(f"in place: {scenarios} scenarios in " +\
+		f"{time.time() - start:.2f}s")
+	flm.model.dispose()
+
+
+def randomTSP(nstops, seed=0):
+	"""
+	Function to create TSP over random stops in a
+	city, with great circle edge weights.
+	"""
+	rnd = random.Random(seed)
+	lat = [41.88 + rnd.uniform(-0.05, 0.05) for _ in range(nstops)]
+	lon = [-87.63 + rnd.uniform(-0.05, 0.05) for _ in range(nstops)]
+	matrix = distanceMatrix(lat, lon).tolist()
+
+	tsp = TSP(list(range(nstops)))
+	for u in range(nstops):
+		for v in range(nstops):
+			if u != v:
+				tsp.addEdge(u, v, matrix[u][v])
+	return tsp
+
+
+def benchmarkRouting(sizes=[20, 40, 80, 160], instances=5,
+maxexhaustive=80):
+	"""
+	Function to compare time and tour length of 
+	exhaustive threeOPT, neighbor list local search
+	and Lin-Kernighan style search starting from 
+	greedy tours. threeOPT is skipped 
+	for more than maxexhaustive stops.
+	"""
+	for nstops in sizes:
+		results = {'threeopt': [0, 0], 'localsearch': [0, 0],
+			'lk': [0, 0]}
+		for seed in range(instances):
+			tsp = randomTSP(nstops, seed)
+			greedytour, _ = tsp.greedyTour(startnode=0)
+
+			if nstops <= maxexhaustive:
+				(_, tourlen), delta, _ = measure(tsp.threeOPT, greedytour)
+				results['threeopt'][0] += delta
+				results['threeopt'][1] += tourlen
+
+			(_, tourlen), delta, _ = measure(tsp.localSearch, greedytour)
+			results['localsearch'][0] += delta
+			results['localsearch'][1] += tourlen
+
+			(_, tourlen), delta, _ = measure(tsp.linKernighan, greedytour)
+			results['lk'][0] += delta
+			results['lk'][1] += tourlen
+
+		for method, (delta, tourlen) in results.items():
+			if tourlen > 0:
+				print(f"{nstops} stops, {method}: {delta / instances:.4f}s, " +\
+					f"mean tour length {tourlen / instances:.2f}")
+
+
+def test():
+	data, _ = syntheticData()
+	benchmarkModelBuild(data)
+
+
+if __name__ == '__main__':
+	test()
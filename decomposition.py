@@ -0,0 +1,242 @@
+from multiprocessing import Pool
+from itertools import combinations
+import os
+
+import pandas as pd
+
+from facilitylocation import FacilityLocationModel
+
+
+def solvePeriod(inputs):
+	"""
+	Function to solve single period flow subproblem
+	with sites restricted to an open site configuration.
+	Module level so it can be sent to worker processes.
+	args:
+		inputs: tuple of (data, buildoptions, threads)
+			data in format of FacilityLocationModel
+	return:
+		objective: float, None if infeasible
+		flows: dataframe from extractFlows
+	"""
+	data, buildoptions, threads = inputs
+
+	flm = FacilityLocationModel(data)
+	flm.modelProblem(**buildoptions)
+	flm.setParameters()
+	flm.model.setParam('OutputFlag', 0)
+	flm.model.setParam('LogFile', '')
+	flm.model.setParam('Threads', threads)
+	flm.solveModel()
+
+	if not flm.hasSolution():
+		flm.model.dispose()
+		return None, None
+
+	objective = flm.model.ObjVal
+	flows = flm.extractFlows()
+	flm.model.dispose()
+	return objective, flows
+
+
+class PeriodDecomposition:
+	"""
+	Class to solve multi-period facility location by
+	decomposing it into single period subproblems.
+
+	Periods are only coupled through siteindicator and
+	maxopensites. Opening a site has no cost, so for a
+	fixed configuration of open sites every period
+	is an independent flow subproblem, and subproblems
+	of all periods (and configurations) are solved
+	concurrently in a process pool.
+	"""
+	def __init__(self, data, processes=None, buildoptions=None):
+		"""
+		args:
+			data: dictionary
+				Same format as FacilityLocationModel
+			processes: int
+				Number of worker processes, defaults to
+				number of cores
+			buildoptions: dictionary
+				Keyword arguments for modelProblem of
+				subproblems, e.g. {'matrixapi': True}
+		"""
+		self.data = data
+		self.processes = processes or os.cpu_count()
+		self.buildoptions = buildoptions or {}
+
+		self.periodid = data['periodid']
+		self.siteid = data['siteid']
+		self.maxopensites = min(data['maxopensites'], len(self.siteid))
+
+		# objective and flows by configuration and period
+		self.evaluated = {}
+
+
+	def periodData(self, periodid, opensites):
+		"""
+		Method to create data for single period
+		subproblem restricted to open sites.
+		"""
+		customerid = self.data['customerid']
+		servicedist = self.data['servicedist']
+		return {
+			'periodid': [periodid],
+			'siteid': list(opensites),
+			'customerid': customerid,
+			'sitecapbyperiod': {periodid:
+				self.data['sitecapbyperiod'][periodid]},
+			'siteslackcapbyperiod': {periodid:
+				self.data['siteslackcapbyperiod'][periodid]},
+			'customerdembyperiod': {periodid:
+				self.data['customerdembyperiod'][periodid]},
+			'servicedist': {(sid, cid): servicedist[sid, cid]
+				for sid in opensites for cid in customerid},
+			'maxopensites': len(opensites)
+		}
+
+
+	def hasCapacity(self, opensites):
+		"""
+		Method to check that open sites have enough
+		capacity including slack for total demand
+		of every period.
+		"""
+		for pid in self.periodid:
+			capacity = sum(self.data['sitecapbyperiod'][pid][sid]
+				+ self.data['siteslackcapbyperiod'][pid][sid]
+				for sid in opensites)
+			if capacity < sum(self.data['customerdembyperiod'][pid].values()):
+				return False
+		return True
+
+
+	def configurations(self):
+		"""
+		Method to enumerate open site configurations.
+		Allowing an additional site never increases cost,
+		so only configurations with maxopensites sites
+		and enough capacity are returned.
+		"""
+		return [
+			frozenset(opensites)
+			for opensites in combinations(self.siteid, self.maxopensites)
+			if self.hasCapacity(opensites)
+		]
+
+
+	def evaluate(self, configurations):
+		"""
+		Method to solve period subproblems of all given
+		configurations (not already evaluated) in parallel.
+		return:
+			objectives: dictionary
+				Total objective by configuration, None if
+				any period subproblem is infeasible
+		"""
+		tasks = []
+		keys = []
+		for opensites in configurations:
+			for pid in self.periodid:
+				if (opensites, pid) not in self.evaluated:
+					keys.append((opensites, pid))
+					tasks.append((
+						self.periodData(pid, sorted(opensites, key=str)),
+						self.buildoptions,
+						1 if self.processes > 1 else 0))
+
+		if tasks:
+			with Pool(min(self.processes, len(tasks))) as p:
+				results = p.map(solvePeriod, tasks)
+			self.evaluated.update(zip(keys, results))
+
+		objectives = {}
+		for opensites in configurations:
+			periodobjectives = [self.evaluated[opensites, pid][0]
+				for pid in self.periodid]
+			objectives[opensites] = None if None in periodobjectives \
+				else sum(periodobjectives)
+		return objectives
+
+
+	def localSearch(self, initial):
+		"""
+		Method to improve a configuration by swapping one
+		open site with one closed site at a time, evaluating
+		all swaps of an iteration in parallel and moving
+		to the best one until no swap improves.
+		"""
+		current = frozenset(initial)
+		currentobjective = self.evaluate([current])[current]
+
+		improved = True
+		while improved:
+			improved = False
+			neighbors = [
+				(current - {siteout}) | {sitein}
+				for siteout in current
+				for sitein in self.siteid if sitein not in current
+			]
+			neighbors = [n for n in neighbors if self.hasCapacity(n)]
+			objectives = self.evaluate(neighbors)
+
+			for opensites, objective in objectives.items():
+				if objective is None:
+					continue
+				if currentobjective is None or \
+				objective < currentobjective - 1e-6:
+					current, currentobjective = opensites, objective
+					improved = True
+
+		return current, currentobjective
+
+
+	def solve(self, method='enumerate', initial=None):
+		"""
+		Method to find best open site configuration.
+		args:
+			method: str
+				'enumerate' solves all configurations,
+				'localsearch' starts from initial (or sites
+				with most capacity) and swaps sites
+			initial: list of site ids for 'localsearch'
+		return:
+			opensites: frozenset of site ids
+			objective: float
+			flows: dataframe of non-zero flows of all
+				periods in format of extractFlows
+		"""
+		if method == 'enumerate':
+			objectives = self.evaluate(self.configurations())
+			objectives = {k: v for k, v in objectives.items()
+				if v is not None}
+			if not objectives:
+				print("No feasible configuration found")
+				return None, None, None
+			opensites = min(objectives, key=objectives.get)
+			objective = objectives[opensites]
+
+		elif method == 'localsearch':
+			if initial is None:
+				totalcapacity = {
+					sid: sum(self.data['sitecapbyperiod'][pid][sid]
+						+ self.data['siteslackcapbyperiod'][pid][sid]
+						for pid in self.periodid)
+					for sid in self.siteid
+				}
+				initial = sorted(self.siteid, key=totalcapacity.get,
+					reverse=True)[:self.maxopensites]
+			opensites, objective = self.localSearch(initial)
+			if objective is None:
+				print("No feasible configuration found")
+				return None, None, None
+
+		else:
+			raise ValueError(f"Unknown method {method}")
+
+		flows = pd.concat(
+			[self.evaluated[opensites, pid][1] for pid in self.periodid],
+			ignore_index=True)
+		return opensites, objective, flows
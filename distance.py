@@ -0,0 +1,339 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# radius of earth in miles
+EARTHRADIUS = 3958.75
+
+
+def haversine(lat1, lon1, lat2, lon2):
+	"""
+	Function to compute great circle distance in miles
+	between points given in degrees. Arguments can be
+	scalars or arrays and are broadcast against each
+	other. Unlike spherical law of cosines, this is
+	safe for identical and very close points.
+	"""
+	lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+	h = np.sin((lat2 - lat1) / 2)**2 \
+		+ np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+	return 2 * EARTHRADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def greatCircleDistance(lat1, lon1, lat2, lon2, decimals=2):
+	"""
+	Function to return great circle distance in miles
+	between two points, rounded to decimals.
+	"""
+	return round(float(haversine(lat1, lon1, lat2, lon2)), decimals)
+
+
+def distanceMatrix(lat1, lon1, lat2=None, lon2=None,
+dtype=np.float64, decimals=2, blocksize=2048, out=None):
+	"""
+	Function to compute great circle distances between
+	every pair of two sets of points.
+	args:
+		lat1, lon1: array like
+			Coordinates (degrees) of row points
+		lat2, lon2: array like (optional)
+			Coordinates of column points, row points
+			are used if not provided
+		dtype: numpy dtype of returned matrix,
+			e.g. np.float32 to halve memory
+		decimals: int
+			Distances are rounded to decimals,
+			no rounding if None
+		blocksize: int
+			Number of rows computed at a time, limits
+			temporary memory for large number of points
+		out: array (optional)
+			Array (e.g. memory mapped) to write into,
+			dtype is ignored if provided
+	return:
+		matrix: array (len(lat1) x len(lat2))
+	"""
+	lat1 = np.asarray(lat1, dtype=np.float64)
+	lon1 = np.asarray(lon1, dtype=np.float64)
+	if lat2 is None:
+		lat2, lon2 = lat1, lon1
+	lat2 = np.asarray(lat2, dtype=np.float64)
+	lon2 = np.asarray(lon2, dtype=np.float64)
+
+	matrix = out if out is not None \
+		else np.empty((len(lat1), len(lat2)), dtype=dtype)
+	for start in range(0, len(lat1), blocksize):
+		end = start + blocksize
+		block = haversine(lat1[start:end, None], lon1[start:end, None],
+			lat2[None, :], lon2[None, :])
+		if decimals is not None:
+			block = np.round(block, decimals)
+		matrix[start:end] = block
+	return matrix
+
+
+class GreatCircleProvider:
+	"""
+	Class to provide distance matrices between locations
+	as great circle distances. Other providers (e.g. 
+	roadnetwork.RoadNetworkProvider) implement same
+	matrix and signature methods.
+	"""
+	def matrix(self, lat1, lon1, lat2=None, lon2=None,
+	dtype=np.float64, decimals=2, out=None):
+		"""
+		Method to compute distances between every pair
+		of two sets of points (see distanceMatrix).
+		"""
+		return distanceMatrix(lat1, lon1, lat2, lon2,
+			dtype=dtype, decimals=decimals, out=out)
+
+
+	def signature(self):
+		"""
+		Method to return string identifying provider
+		and its data, used in cache keys.
+		"""
+		return 'greatcircle'
+
+
+class DistanceMatrix:
+	"""
+	Class to store distances between locations as a
+	dense NumPy array (float32 by default) with a map
+	from location id to row/column index, instead of
+	a dictionary keyed by every (id, id) pair.
+
+	Lookups by id pair return python floats rounded to
+	decimals, bulk consumers can use indices and
+	submatrix directly.
+	"""
+	def __init__(self, ids, matrix, decimals=2, path=None):
+		"""
+		args:
+			ids: list of location ids
+			matrix: square array, row/column k
+				belongs to ids[k]
+			decimals: int
+				Rounding of distances returned
+			path: str (optional)
+				.npy file matrix is memory mapped from.
+				If set, pickled copies (e.g. sent to
+				worker processes) map file read only
+				instead of carrying the matrix.
+		"""
+		self.ids = list(ids)
+		self.index = {locid: k for k, locid in enumerate(self.ids)}
+		self.matrix = matrix
+		self.decimals = decimals
+		self.path = path
+
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		if self.path is not None:
+			del state['matrix']
+		return state
+
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		if self.path is not None:
+			self.matrix = np.load(self.path, mmap_mode='r')
+
+
+	@classmethod
+	def fromCoordinates(cls, ids, lat, lon, dtype=np.float32, decimals=2,
+	provider=None):
+		"""
+		Method to create distance matrix between locations
+		with coordinates lat, lon (lists in same order as
+		ids), great circle unless provider is given.
+		"""
+		provider = provider or GreatCircleProvider()
+		return cls(ids, provider.matrix(lat, lon, dtype=dtype,
+			decimals=decimals), decimals)
+
+
+	def __getitem__(self, key):
+		u, v = key
+		return round(float(self.matrix[self.index[u], self.index[v]]),
+			self.decimals)
+
+
+	def __contains__(self, locid):
+		return locid in self.index
+
+
+	def __len__(self):
+		return len(self.ids)
+
+
+	def indices(self, ids):
+		"""
+		Method to return array of matrix indices of ids
+		"""
+		return np.fromiter((self.index[locid] for locid in ids),
+			dtype=np.intp, count=len(ids))
+
+
+	def submatrix(self, rowids, colids=None):
+		"""
+		Method to return distances between rowids and
+		colids (rowids if not provided) as float64 array
+		rounded to decimals.
+		"""
+		rows = self.indices(rowids)
+		cols = rows if colids is None else self.indices(colids)
+		return np.round(self.matrix[np.ix_(rows, cols)].astype(np.float64),
+			self.decimals)
+
+
+class DistanceCache:
+	"""
+	Class to persist distance matrices on disk as
+	memory mapped .npy files, each with an index file
+	of location ids. Files are named by a hash of
+	location ids and coordinates (and distance provider),
+	so runs with unchanged locations open the matrix
+	without recomputing it.
+	"""
+	def __init__(self, directory='distancecache', provider=None):
+		self.directory = directory
+		self.provider = provider or GreatCircleProvider()
+		os.makedirs(directory, exist_ok=True)
+
+
+	def key(self, ids, lat, lon, dtype, decimals):
+		"""
+		Method to return hash of locations, provider
+		and matrix format.
+		"""
+		digest = hashlib.sha1()
+		digest.update(json.dumps([self.provider.signature(),
+			str(np.dtype(dtype)), decimals, list(ids)]).encode())
+		digest.update(np.asarray(lat, dtype=np.float64).tobytes())
+		digest.update(np.asarray(lon, dtype=np.float64).tobytes())
+		return digest.hexdigest()
+
+
+	def load(self, ids, lat, lon, dtype=np.float32, decimals=2):
+		"""
+		Method to return DistanceMatrix of locations,
+		memory mapped read only from cache, computing
+		and storing it first if not cached.
+		args:
+			ids: list of location ids
+			lat, lon: lists of coordinates in
+				same order as ids
+		"""
+		key = self.key(ids, lat, lon, dtype, decimals)
+		path = os.path.join(self.directory, key + '.npy')
+		indexpath = os.path.join(self.directory, key + '.index.json')
+
+		if not (os.path.exists(path) and os.path.exists(indexpath)):
+			# write to temporary files first so an interrupted
+			# run never leaves a partial matrix behind
+			temppath = path + f'.{os.getpid()}.tmp'
+			matrix = np.lib.format.open_memmap(temppath, mode='w+',
+				dtype=dtype, shape=(len(ids), len(ids)))
+			self.provider.matrix(lat, lon, decimals=decimals, out=matrix)
+			matrix.flush()
+			del matrix
+			os.replace(temppath, path)
+
+			with open(indexpath + '.tmp', 'w') as f:
+				json.dump({'ids': list(ids), 'decimals': decimals}, f)
+			os.replace(indexpath + '.tmp', indexpath)
+
+		with open(indexpath) as f:
+			index = json.load(f)
+		return DistanceMatrix(index['ids'], np.load(path, mmap_mode='r'),
+			index['decimals'], path)
+
+
+class BlockDistanceCache:
+	"""
+	Class to keep distance blocks (DistanceMatrix of a
+	group of locations, e.g. customers of a site) in
+	memory within a budget, evicting least recently used
+	blocks once it is exceeded. Block is reused if it
+	covers all requested locations, otherwise it is
+	recomputed for union of its and requested locations
+	so later requests (e.g. next period) hit.
+
+	Counters hits, misses and evictions help size 
+	budget for production nodes.
+	"""
+	def __init__(self, maxbytes=2 * 1024**3, dtype=np.float32, decimals=2,
+	provider=None):
+		"""
+		args:
+			maxbytes: int
+				Memory budget of all blocks
+			provider: distance provider, great
+				circle if not provided
+		"""
+		self.maxbytes = maxbytes
+		self.provider = provider
+		self.dtype = dtype
+		self.decimals = decimals
+		self.blocks = OrderedDict()
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+
+	def get(self, name, ids, lat, lon):
+		"""
+		Method to return DistanceMatrix block covering
+		ids, from cache if possible.
+		args:
+			name: hashable block name
+			ids: list of location ids
+			lat, lon: dictionaries of coordinates
+				by location id
+		"""
+		block = self.blocks.get(name)
+		if block is not None and all(locid in block for locid in ids):
+			self.blocks.move_to_end(name)
+			self.hits += 1
+			return block
+
+		self.misses += 1
+		if block is not None:
+			ids = block.ids + [locid for locid in ids if locid not in block]
+			self.remove(name)
+
+		block = DistanceMatrix.fromCoordinates(ids,
+			[lat[locid] for locid in ids], [lon[locid] for locid in ids],
+			dtype=self.dtype, decimals=self.decimals,
+			provider=self.provider)
+		self.blocks[name] = block
+		self.nbytes += block.matrix.nbytes
+
+		# keep at least the requested block
+		while self.nbytes > self.maxbytes and len(self.blocks) > 1:
+			oldest = next(iter(self.blocks))
+			self.remove(oldest)
+			self.evictions += 1
+
+		return block
+
+
+	def remove(self, name):
+		block = self.blocks.pop(name)
+		self.nbytes -= block.matrix.nbytes
+
+
+	def stats(self):
+		"""
+		Method to return cache counters and memory use
+		"""
+		return {'hits': self.hits, 'misses': self.misses,
+			'evictions': self.evictions, 'blocks': len(self.blocks),
+			'nbytes': self.nbytes}
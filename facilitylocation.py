@@ -1,6 +1,21 @@
-from gurobipy import *
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+try:
+	from gurobipy import *
+except ImportError:
+	# gurobipy is only needed by this class, license free
+	# solvers in heuristicsolver.py work without it
+	Model = None
 
 class FacilityLocationModel:
+	# columns of dataframe returned by extractFlows
+	flowcolumns = ['PeriodID', 'SiteID', 'CustomerID', 
+		'FlowUnits', 'Distance', 'ObjectiveValue']
+
 	def __init__(self, data):
 		"""
 		args:
@@ -75,8 +90,123 @@ class FacilityLocationModel:
 		except KeyError as e:
 			raise KeyError(f"Missing required data {e}")
 
+		self.matrixapi = False
+		self.formulation = 'indicator'
+		self.allowedsites = None
+		self.strengthen = False
+
+		# candidate arcs, all site-customer pairs unless set
+		self.candidatek = None
+		self.candidateradius = None
+		self.arcmask = None
 
-	def modelProblem(self, exportmps=False):
+
+	def setCandidateArcs(self, k=None, radius=None, maxpricingrounds=5):
+		"""
+		Method to restrict flow variables to plausible
+		site-customer pairs (candidate arcs) instead of
+		every site x customer pair.
+
+		Customer keeps arcs to its k nearest sites and
+		to all sites within radius. Nearest site is always 
+		kept. solveModel then checks restricted model and
+		adds arcs back (see priceArcs) if it is infeasible
+		or an excluded arc would improve the solution.
+
+		args:
+			k: int
+				Number of nearest sites per customer
+			radius: int/float
+				Max service distance of candidate arcs
+			maxpricingrounds: int
+				Max number of times model is rebuilt
+				with additional arcs
+		"""
+		self.candidatek = k
+		self.candidateradius = radius
+		self.maxpricingrounds = maxpricingrounds
+		self.arcmask = None
+
+
+	def candidateArcMask(self):
+		"""
+		Method to return boolean array (sites x customers)
+		of candidate arcs based on candidatek and 
+		candidateradius.
+		"""
+		nsites = len(self.siteid)
+		if self.candidatek is None and self.candidateradius is None:
+			return np.ones(self.distance.shape, dtype=bool)
+
+		k = max(1, min(self.candidatek or 1, nsites))
+		nearest = np.argsort(self.distance, axis=0, kind='stable')[:k]
+		mask = np.zeros(self.distance.shape, dtype=bool)
+		np.put_along_axis(mask, nearest, True, axis=0)
+
+		if self.candidateradius is not None:
+			mask |= self.distance <= self.candidateradius
+
+		return mask
+
+
+	def buildArrays(self):
+		"""
+		Method to convert input dictionaries into
+		NumPy arrays indexed by position in periodid,
+		siteid and customerid.
+
+		Sets following attributes -
+			demand: array (periods x customers)
+			capacity: array (periods x sites)
+			slackcapacity: array (periods x sites)
+			distance: array (sites x customers)
+			arcmask: boolean array (sites x customers)
+				of pairs (arcs) flow variables are 
+				created for
+			arcsite, arccustomer: arrays of site and
+				customer index for every arc
+			arcs: list of (siteid, customerid) for
+				every arc
+			customerarcs, customerarcstart: arcs of
+				customer j are customerarcs[
+				customerarcstart[j]:customerarcstart[j+1]]
+		"""
+		self.siteindex = {sid: i for i, sid in enumerate(self.siteid)}
+		self.customerindex = {
+			cid: j for j, cid in enumerate(self.customerid)}
+
+		self.demand = np.array(
+			[[self.customerdembyperiod[p][j] for j in self.customerid]
+				for p in self.periodid],
+			dtype=float).reshape(len(self.periodid), len(self.customerid))
+		self.capacity = np.array(
+			[[self.sitecapbyperiod[p][i] for i in self.siteid]
+				for p in self.periodid],
+			dtype=float).reshape(len(self.periodid), len(self.siteid))
+		self.slackcapacity = np.array(
+			[[self.siteslackcapbyperiod[p][i] for i in self.siteid]
+				for p in self.periodid],
+			dtype=float).reshape(len(self.periodid), len(self.siteid))
+		self.distance = np.array(
+			[[self.servicedist[i,j] for j in self.customerid]
+				for i in self.siteid],
+			dtype=float).reshape(len(self.siteid), len(self.customerid))
+
+		# site major, arcmask is kept if arcs were added back
+		if self.arcmask is None:
+			self.arcmask = self.candidateArcMask()
+		self.arcsite, self.arccustomer = np.nonzero(self.arcmask)
+		self.customerarcs = np.argsort(self.arccustomer, kind='stable')
+		self.customerarcstart = np.concatenate([[0], np.cumsum(
+			np.bincount(self.arccustomer, minlength=len(self.customerid)))])
+		self.arcs = [
+			(self.siteid[i], self.customerid[j])
+			for i, j in zip(self.arcsite.tolist(), self.arccustomer.tolist())
+		]
+
+
+	def modelProblem(self, exportmps=False, matrixapi=False,
+	formulation='indicator', strengthen=False):
 		"""
 		Method models basic facility location
 		with slack capacity for sites.
@@ -88,23 +218,57 @@ class FacilityLocationModel:
 			exportmps: boolean
 				If true, formulation is exported
 				as model.mps file.
+			matrixapi: boolean
+				If true, model is built with gurobipy
+				matrix API (see modelProblemMatrix).
+				Creates same model, much faster for
+				large number of customers.
+			formulation: str
+				'indicator' links flows to flow and
+				service indicators with indicator
+				constraints per (period, site, customer).
+				'bigm' uses linear constraints instead -
+					flow <= demand * flowindicator
+				per (period, site, customer) and
+					sum of flows <= (capacity + max slack)
+						* serviceindicator
+				per (period, site), which is much
+				lighter on presolve and memory.
+			strengthen: boolean
+				With 'bigm', also adds cuts
+					flowindicator <= serviceindicator
+				tightening LP relaxation.
 		"""
+		if Model is None:
+			raise ImportError("gurobipy is required to build model, " +\
+				"see heuristicsolver.py for license free solvers")
+		if formulation not in ['indicator', 'bigm']:
+			raise ValueError(f"Unknown formulation {formulation}")
+
+		self.exportmps = exportmps
+		self.matrixapi = matrixapi
+		self.formulation = formulation
+		self.strengthen = strengthen
+		if matrixapi:
+			self.modelProblemMatrix(exportmps)
+			return
+
+		self.buildArrays()
+
 		try:
 			self.model = Model("Facility Location")
 
 			# variables
 			flow = self.model.addVars(
 				self.periodid,
-				self.siteid,
-				self.customerid,
+				self.arcs,
 				vtype=GRB.CONTINUOUS,
 				lb=0,
 				name='flow')
 
 			flowindicator = self.model.addVars(
 				self.periodid,
-				self.siteid,
-				self.customerid,
+				self.arcs,
 				vtype=GRB.BINARY,
 				name='flowindicator')
 
@@ -126,16 +290,20 @@ class FacilityLocationModel:
 				lb=0,
 				name='slackcap')
 
+			self.flow = flow
+			self.flowindicator = flowindicator
+			self.serviceindicator = serviceindicator
+			self.siteindicator = siteindicator
+			self.slackcap = slackcap
+
 			# objective
 			self.model.setObjective(
 				sum(self.servicedist[i,j]*flowindicator[p,i,j]
 					for p in self.periodid
-					for i in self.siteid
-					for j in self.customerid)
+					for i, j in self.arcs)
 				+ sum(0.1*self.servicedist[i,j]*flow[p,i,j]
 					for p in self.periodid
-					for i in self.siteid
-					for j in self.customerid)
+					for i, j in self.arcs)
 				+ 0.25*sum(slackcap[p,i]
 					for p in self.periodid
 					for i in self.siteid)
@@ -144,44 +312,74 @@ class FacilityLocationModel:
 			)
 
 			# constraints
-			self.model.addConstrs(
-				sum(flow[p,i,j] for i in self.siteid)
+			self.demandconstrs = self.model.addConstrs(
+				flow.sum(p,'*',j)
 				== self.customerdembyperiod[p][j]
 				for p in self.periodid
 				for j in self.customerid
 			)
 
-			self.model.addConstrs(
-				(flowindicator[p,i,j] == 0) >>
-				(flow[p,i,j] == 0)
-				for p in self.periodid
-				for i in self.siteid
-				for j in self.customerid
-			)
+			if self.formulation == 'bigm':
+				self.flowlinkconstrs = self.model.addConstrs(
+					flow[p,i,j] 
+					<= self.customerdembyperiod[p][j] \
+					* flowindicator[p,i,j]
+					for p in self.periodid
+					for i, j in self.arcs
+				)
 
-			self.model.addConstrs(
-				(serviceindicator[p,i] == 0) >> 
-				(flow[p,i,j] == 0)
-				for p in self.periodid
-				for i in self.siteid
-				for j in self.customerid
-			)
+				self.servicelinkconstrs = self.model.addConstrs(
+					flow.sum(p,i,'*')
+					<= (self.sitecapbyperiod[p][i] \
+					+ self.siteslackcapbyperiod[p][i]) \
+					* serviceindicator[p,i]
+					for p in self.periodid
+					for i in self.siteid
+				)
 
-			self.model.addConstrs(
-				(siteindicator[i] == 0) >>
-				(serviceindicator[p,i] == 0)
-				for p in self.periodid
-				for i in self.siteid
-			)
+				self.model.addConstrs(
+					serviceindicator[p,i] <= siteindicator[i]
+					for p in self.periodid
+					for i in self.siteid
+				)
+
+				if self.strengthen:
+					self.model.addConstrs(
+						flowindicator[p,i,j] 
+						<= serviceindicator[p,i]
+						for p in self.periodid
+						for i, j in self.arcs
+					)
+			else:
+				self.model.addConstrs(
+					(flowindicator[p,i,j] == 0) >>
+					(flow[p,i,j] == 0)
+					for p in self.periodid
+					for i, j in self.arcs
+				)
+
+				self.model.addConstrs(
+					(serviceindicator[p,i] == 0) >> 
+					(flow[p,i,j] == 0)
+					for p in self.periodid
+					for i, j in self.arcs
+				)
+
+				self.model.addConstrs(
+					(siteindicator[i] == 0) >>
+					(serviceindicator[p,i] == 0)
+					for p in self.periodid
+					for i in self.siteid
+				)
 
 			# Max additional 1 site, existing 3
-			self.model.addConstr(
+			self.maxsitesconstr = self.model.addConstr(
 				sum(siteindicator[i] for i in self.siteid) 
 				<= self.maxopensites
 			)
 
-			self.model.addConstrs(
-				sum(flow[p,i,j] for j in self.customerid)
+			self.capacityconstrs = self.model.addConstrs(
+				flow.sum(p,i,'*')
 				<= self.sitecapbyperiod[p][i] \
 				+ slackcap[p,i]
 				for p in self.periodid
@@ -189,7 +387,7 @@ class FacilityLocationModel:
 			)
 
 			#max slack
-			self.model.addConstrs(
+			self.slackconstrs = self.model.addConstrs(
 				slackcap[p,i] \
 				<= self.siteslackcapbyperiod[p][i]
 				for p in self.periodid
@@ -199,6 +397,175 @@ class FacilityLocationModel:
 		except GurobiError as e:
 			print(f"Gurobi Error occured {e}")
 
+		self.handlelists = {}
+		self.laststart = None
+		self.applyAllowedSites()
+
+		if exportmps:
+			self.model.write('model.mps')
+
+
+	def modelProblemMatrix(self, exportmps=False):
+		"""
+		Method models same facility location problem
+		as modelProblem using gurobipy matrix API.
+		Variables are created as MVar and linear
+		constraints as sparse (CSR) coefficient matrices
+		built from NumPy arrays, avoiding a python
+		expression per (period, site, customer).
+
+		Flow variables are laid out period major,
+		followed by arcs (see buildArrays), i.e.
+		flow[p*len(arcs) + a]. Requires gurobipy 11
+		or later for matrix indicator constraints.
+
+		args:
+			exportmps: boolean
+				If true, formulation is exported
+				as model.mps file.
+		"""
+		self.buildArrays()
+
+		nperiods = len(self.periodid)
+		nsites = len(self.siteid)
+		ncustomers = len(self.customerid)
+		narcs = len(self.arcsite)
+		nflows = nperiods * narcs
+
+		# period and arc of every flow variable
+		colperiod = np.repeat(np.arange(nperiods), narcs)
+		colarc = np.tile(np.arange(narcs), nperiods)
+		colsite = colperiod * nsites + self.arcsite[colarc]
+		colcustomer = colperiod * ncustomers + self.arccustomer[colarc]
+		arcdist = self.distance[self.arcsite, self.arccustomer][colarc]
+
+		try:
+			self.model = Model("Facility Location")
+
+			# variables
+			flow = self.model.addMVar(
+				nflows,
+				vtype=GRB.CONTINUOUS,
+				lb=0,
+				name='flow')
+
+			flowindicator = self.model.addMVar(
+				nflows,
+				vtype=GRB.BINARY,
+				name='flowindicator')
+
+			serviceindicator = self.model.addMVar(
+				nperiods * nsites,
+				vtype=GRB.BINARY,
+				name='serviceindicator')
+
+			siteindicator = self.model.addMVar(
+				nsites,
+				vtype=GRB.BINARY,
+				name='siteindicator')
+
+			slackcap = self.model.addMVar(
+				nperiods * nsites,
+				vtype=GRB.CONTINUOUS,
+				lb=0,
+				name='slackcap')
+
+			self.flow = flow
+			self.flowindicator = flowindicator
+			self.serviceindicator = serviceindicator
+			self.siteindicator = siteindicator
+			self.slackcap = slackcap
+
+			# objective
+			self.model.setObjective(
+				arcdist @ flowindicator
+				+ (0.1 * arcdist) @ flow
+				+ 0.25 * slackcap.sum(),
+				sense=GRB.MINIMIZE
+			)
+
+			# constraints
+			demandmatrix = sp.csr_matrix(
+				(np.ones(nflows), (colcustomer, np.arange(nflows))),
+				shape=(nperiods * ncustomers, nflows)
+			)
+			self.demandconstrs = self.model.addConstr(
+				demandmatrix @ flow == self.demand.ravel(),
+				name='demand'
+			)
+
+			capacitymatrix = sp.csr_matrix(
+				(np.ones(nflows), (colsite, np.arange(nflows))),
+				shape=(nperiods * nsites, nflows)
+			)
+			rowsiteindicator = siteindicator[
+				np.tile(np.arange(nsites), nperiods)]
+
+			if self.formulation == 'bigm':
+				coldemand = self.demand.ravel()[colcustomer]
+				self.flowlinkconstrs = self.model.addConstr(
+					flow - coldemand * flowindicator <= 0,
+					name='flowindicatorlink'
+				)
+
+				self.servicelinkconstrs = self.model.addConstr(
+					capacitymatrix @ flow 
+					- (self.capacity + self.slackcapacity).ravel() \
+					* serviceindicator <= 0,
+					name='serviceindicatorlink'
+				)
+
+				self.model.addConstr(
+					serviceindicator <= rowsiteindicator,
+					name='siteindicatorlink'
+				)
+
+				if self.strengthen:
+					self.model.addConstr(
+						flowindicator <= serviceindicator[colsite],
+						name='strengthen'
+					)
+			else:
+				self.model.addGenConstrIndicator(
+					flowindicator, False, flow, GRB.EQUAL, 0.0,
+					name='flowindicatorlink'
+				)
+
+				self.model.addGenConstrIndicator(
+					serviceindicator[colsite], False, flow, GRB.EQUAL, 0.0,
+					name='serviceindicatorlink'
+				)
+
+				self.model.addGenConstrIndicator(
+					rowsiteindicator, False, serviceindicator, GRB.EQUAL, 0.0,
+					name='siteindicatorlink'
+				)
+
+			# Max additional 1 site, existing 3
+			self.maxsitesconstr = self.model.addConstr(
+				siteindicator.sum() <= self.maxopensites,
+				name='maxopensites'
+			)
+
+			self.capacityconstrs = self.model.addConstr(
+				capacitymatrix @ flow - slackcap
+				<= self.capacity.ravel(),
+				name='capacity'
+			)
+
+			#max slack
+			self.slackconstrs = self.model.addConstr(
+				slackcap <= self.slackcapacity.ravel(),
+				name='maxslack'
+			)
+
+		except GurobiError as e:
+			print(f"Gurobi Error occured {e}")
+
+		self.handlelists = {}
+		self.laststart = None
+		self.applyAllowedSites()
+
 		if exportmps:
 			self.model.write('model.mps')
 
@@ -215,10 +582,533 @@ class FacilityLocationModel:
 
 	def solveModel(self):
 		"""
-		Method to call to solve
+		Method to call to solve. If model was built
+		on candidate arcs (see setCandidateArcs), 
+		excluded arcs are priced after solve and model
+		is rebuilt, warm started and solved again
+		while arcs are being added back. Parameters
+		of model, set by setParameters or by caller,
+		are carried over to rebuilt model. Pricing
+		stops, keeping incumbent, when solve stops
+		on a limit (e.g. TimeLimit).
 		"""
 		self.model.optimize()
 
+		if self.candidatek is None and self.candidateradius is None:
+			return
+
+		for _ in range(self.maxpricingrounds):
+			if self.model.status not in [GRB.Status.OPTIMAL,
+			GRB.Status.SUBOPTIMAL, GRB.Status.INFEASIBLE,
+			GRB.Status.INF_OR_UNBD]:
+				break
+
+			solution = self.getSolutionArrays() \
+				if self.hasSolution() else None
+
+			if self.priceArcs() == 0:
+				break
+
+			# non default parameters are copied through a prm file
+			with tempfile.TemporaryDirectory() as tmpdir:
+				paramfile = os.path.join(tmpdir, 'model.prm')
+				self.model.write(paramfile)
+				self.model.dispose()
+				self.modelProblem(self.exportmps, matrixapi=self.matrixapi,
+					formulation=self.formulation, strengthen=self.strengthen)
+				self.model.read(paramfile)
+			if solution is not None:
+				self.setStart(solution)
+			self.model.optimize()
+
+
+	def priceArcs(self):
+		"""
+		Method to add excluded arcs back to arcmask.
+
+		If model is infeasible, number of nearest sites 
+		per customer is doubled. If it has a solution, integer
+		variables are fixed to solution to get duals of
+		demand and capacity constraints, and excluded
+		arcs to sites in service with negative reduced
+		cost are added. Fixed cost of arc is charged
+		as if arc carries full customer demand.
+		return:
+			added: int
+				Number of arcs added
+		"""
+		before = int(self.arcmask.sum())
+
+		if self.model.status in [GRB.Status.INFEASIBLE,
+		GRB.Status.INF_OR_UNBD]:
+			nsites = len(self.siteid)
+			self.candidatek = min(nsites, 2 * (self.candidatek or 1))
+			self.arcmask |= self.candidateArcMask()
+			return int(self.arcmask.sum()) - before
+		if not self.hasSolution():
+			return 0
+
+		fixed = self.model.fixed()
+		fixed.setParam(GRB.Param.OutputFlag, 0)
+		fixed.optimize()
+		if fixed.status != GRB.Status.OPTIMAL:
+			fixed.dispose()
+			return 0
+
+		pi = np.array(fixed.getAttr('Pi', fixed.getConstrs()))
+		demanddual = pi[self.constrIndices(self.demandconstrs)].reshape(
+			self.demand.shape)
+		capacitydual = pi[self.constrIndices(self.capacityconstrs)].reshape(
+			self.capacity.shape)
+		inservice = self.getAttrArray(self.serviceindicator).reshape(
+			self.capacity.shape) > 0.5
+
+		# reduced cost (periods x sites x customers)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			fixedcharge = np.where(self.demand[:, None, :] > 0,
+				self.distance[None, :, :] / self.demand[:, None, :], 0)
+		reducedcost = 0.1 * self.distance[None, :, :] + fixedcharge \
+			- demanddual[:, None, :] - capacitydual[:, :, None]
+
+		improving = (reducedcost < -1e-6) & inservice[:, :, None] \
+			& (self.demand[:, None, :] > 0)
+		self.arcmask |= improving.any(axis=0)
+		fixed.dispose()
+
+		return int(self.arcmask.sum()) - before
+
+
+	def constrIndices(self, constrs):
+		"""
+		Method to return model indices of constraints
+		created with addConstrs or matrix addConstr.
+		"""
+		if self.matrixapi:
+			constrs = constrs.tolist()
+		else:
+			constrs = constrs.values()
+		return np.array([c.index for c in constrs], dtype=int)
+
+
+	def getAttrArray(self, variables, attr='X'):
+		"""
+		Method to get attribute values of variables
+		created with addVars or addMVar as flat array.
+		"""
+		if self.matrixapi:
+			return np.asarray(getattr(variables, attr), dtype=float)
+		return np.asarray(
+			self.model.getAttr(attr, list(variables.values())), dtype=float)
+
+
+	def setAttrArray(self, variables, attr, values):
+		"""
+		Method to set attribute values of variables
+		created with addVars or addMVar from flat array.
+		"""
+		values = np.asarray(values, dtype=float).ravel()
+		if self.matrixapi:
+			setattr(variables, attr, values)
+		else:
+			self.model.setAttr(attr, list(variables.values()), values.tolist())
+
+
+	def getSolutionArrays(self):
+		"""
+		Method to return current solution as dense
+		arrays independent of arcs in model -
+			'flow': periods x sites x customers
+			'slackcap': periods x sites
+			'serviceindicator': periods x sites
+			'siteindicator': sites
+		"""
+		flow = np.zeros(
+			(len(self.periodid),) + self.distance.shape)
+		flow[:, self.arcsite, self.arccustomer] = self.getFlowValues()
+		return {
+			'flow': flow,
+			'slackcap': self.getAttrArray(self.slackcap).reshape(
+				self.capacity.shape),
+			'serviceindicator': self.getAttrArray(
+				self.serviceindicator).reshape(self.capacity.shape),
+			'siteindicator': self.getAttrArray(self.siteindicator)
+		}
+
+
+	def setStart(self, solution):
+		"""
+		Method to load MIP start from dense arrays
+		in format returned by getSolutionArrays.
+		Only 'flow' is required, indicators and 
+		slack are derived from flows if missing.
+		"""
+		flow = solution['flow'][:, self.arcsite, self.arccustomer]
+		siteflow = solution['flow'].sum(axis=2)
+
+		serviceindicator = solution.get('serviceindicator',
+			(siteflow > 0).astype(float))
+		siteindicator = solution.get('siteindicator',
+			(np.asarray(serviceindicator).max(axis=0) > 0).astype(float))
+		slackcap = solution.get('slackcap',
+			np.clip(siteflow - self.capacity, 0, self.slackcapacity))
+
+		self.setAttrArray(self.flow, 'Start', flow)
+		self.setAttrArray(self.flowindicator, 'Start', flow > 0)
+		self.setAttrArray(self.serviceindicator, 'Start', serviceindicator)
+		self.setAttrArray(self.siteindicator, 'Start', siteindicator)
+		self.setAttrArray(self.slackcap, 'Start', slackcap)
+
+
+	def elementHandle(self, name, key, flatindex):
+		"""
+		Method to return single Var or Constr object
+		of variables or constraints stored as attribute
+		name, by key for addVars/addConstrs or by flat 
+		index for matrix API.
+		"""
+		container = getattr(self, name)
+		if not self.matrixapi:
+			return container[key]
+		if name not in self.handlelists:
+			self.handlelists[name] = container.tolist()
+		return self.handlelists[name][flatindex]
+
+
+	def keepStart(self):
+		"""
+		Method to keep current solution, before model
+		is modified, to warm start reoptimize from.
+		"""
+		if self.laststart is None and self.hasSolution():
+			self.laststart = self.getSolutionArrays()
+
+
+	def setServiceLink(self, p, i):
+		"""
+		Method to update big-M coefficient of aggregated
+		service indicator constraint of period index p
+		and site index i after capacity change.
+		"""
+		if self.formulation != 'bigm':
+			return
+		pid, sid = self.periodid[p], self.siteid[i]
+		flatindex = p * len(self.siteid) + i
+		self.model.chgCoeff(
+			self.elementHandle('servicelinkconstrs', (pid, sid), flatindex),
+			self.elementHandle('serviceindicator', (pid, sid), flatindex),
+			-(self.capacity[p, i] + self.slackcapacity[p, i]))
+
+
+	def setCapacity(self, periodid, siteid, capacity):
+		"""
+		Method to change capacity of site in a period
+		in built model.
+		"""
+		self.keepStart()
+		p, i = self.periodid.index(periodid), self.siteindex[siteid]
+		self.capacity[p, i] = capacity
+		self.sitecapbyperiod = {**self.sitecapbyperiod,
+			periodid: {**self.sitecapbyperiod[periodid], siteid: capacity}}
+
+		self.elementHandle('capacityconstrs', (periodid, siteid),
+			p * len(self.siteid) + i).RHS = capacity
+		self.setServiceLink(p, i)
+
+
+	def setSlackLimit(self, periodid, siteid, slack):
+		"""
+		Method to change max slack capacity of site in
+		a period in built model.
+		"""
+		self.keepStart()
+		p, i = self.periodid.index(periodid), self.siteindex[siteid]
+		self.slackcapacity[p, i] = slack
+		self.siteslackcapbyperiod = {**self.siteslackcapbyperiod,
+			periodid: {**self.siteslackcapbyperiod[periodid], siteid: slack}}
+
+		self.elementHandle('slackconstrs', (periodid, siteid),
+			p * len(self.siteid) + i).RHS = slack
+		self.setServiceLink(p, i)
+
+
+	def setDemand(self, periodid, demands):
+		"""
+		Method to change customer demands of a period
+		in built model.
+		args:
+			periodid: period id
+			demands: dictionary
+				Demand by customer id
+		"""
+		self.keepStart()
+		p = self.periodid.index(periodid)
+		ncustomers = len(self.customerid)
+		narcs = len(self.arcsite)
+		self.customerdembyperiod = {**self.customerdembyperiod,
+			periodid: {**self.customerdembyperiod[periodid], **demands}}
+
+		for cid, demand in demands.items():
+			j = self.customerindex[cid]
+			self.demand[p, j] = demand
+			self.elementHandle('demandconstrs', (periodid, cid),
+				p * ncustomers + j).RHS = demand
+
+			if self.formulation == 'bigm':
+				for a in self.customerarcs[self.customerarcstart[j]:
+				self.customerarcstart[j + 1]].tolist():
+					key = (periodid, self.siteid[self.arcsite[a]], cid)
+					self.model.chgCoeff(
+						self.elementHandle('flowlinkconstrs', key, p * narcs + a),
+						self.elementHandle('flowindicator', key, p * narcs + a),
+						-demand)
+
+
+	def setAllowedSites(self, siteids=None):
+		"""
+		Method to restrict sites that can be open in
+		built model. All sites are allowed if None.
+		"""
+		self.keepStart()
+		self.allowedsites = None if siteids is None else set(siteids)
+		self.applyAllowedSites()
+
+
+	def applyAllowedSites(self):
+		"""
+		Method to set upper bound of site indicators
+		based on allowedsites.
+		"""
+		if self.allowedsites is None:
+			upper = np.ones(len(self.siteid))
+		else:
+			upper = np.array([1 if sid in self.allowedsites else 0
+				for sid in self.siteid], dtype=float)
+		self.setAttrArray(self.siteindicator, 'UB', upper)
+
+
+	def setMaxOpenSites(self, maxopensites):
+		"""
+		Method to change max number of open sites
+		in built model.
+		"""
+		self.keepStart()
+		self.maxopensites = maxopensites
+		constr = self.maxsitesconstr
+		if self.matrixapi:
+			constr = constr.item()
+		constr.RHS = maxopensites
+
+
+	def reoptimize(self):
+		"""
+		Method to solve model again after changes,
+		starting from solution before the changes
+		(Gurobi repairs it if no longer feasible).
+		"""
+		if self.laststart is not None:
+			self.setStart(self.laststart)
+			self.laststart = None
+		self.solveModel()
+
+
+	def greedyOpenSites(self):
+		"""
+		Method to pick maxopensites sites greedily, adding
+		one site at a time that most reduces cost of 
+		serving every customer from its nearest open site
+		with average demand over periods. Only sites
+		allowed by setAllowedSites are picked.
+		return:
+			opensites: array of site indices
+		"""
+		allowed = [i for i, sid in enumerate(self.siteid)
+			if self.allowedsites is None or sid in self.allowedsites]
+		cost = self.distance * (1 + 0.1 * self.demand.mean(axis=0))
+
+		opensites = []
+		nearest = np.full(cost.shape[1], np.inf)
+		for _ in range(min(self.maxopensites, len(allowed))):
+			candidates = [i for i in allowed if i not in opensites]
+			totals = [np.minimum(nearest, cost[i]).sum() for i in candidates]
+			best = candidates[int(np.argmin(totals))]
+			opensites.append(best)
+			nearest = np.minimum(nearest, cost[best])
+		return np.array(sorted(opensites), dtype=int)
+
+
+	def greedyAssignment(self, opensites=None):
+		"""
+		Method to create a feasible flow plan using a
+		regret based capacitated assignment heuristic.
+
+		Customers of every period are assigned, in 
+		decreasing order of regret (difference between
+		cost of their second best and best open site), to
+		the cheapest open site with enough capacity left,
+		using slack capacity at its cost if needed. Demand
+		that fits no single site is split across sites,
+		demand beyond capacity left at all open sites
+		(or without candidate arc to any of them)
+		stays unassigned.
+		args:
+			opensites: array of site indices (optional)
+				Sites to assign to, picked by 
+				greedyOpenSites if not provided
+		return:
+			solution: dictionary with 'flow' and
+				'siteindicator' arrays (see setStart)
+		"""
+		if opensites is None:
+			opensites = self.greedyOpenSites()
+		opensites = np.asarray(opensites, dtype=int)
+		nperiods, ncustomers = self.demand.shape
+		flow = np.zeros((nperiods,) + self.distance.shape)
+
+		for p in range(nperiods):
+			demand = self.demand[p]
+			regular = self.capacity[p, opensites].copy()
+			slack = self.slackcapacity[p, opensites].copy()
+
+			# cost of serving full demand (open sites x customers),
+			# infinite on arcs not in model
+			cost = np.where(self.arcmask[opensites],
+				self.distance[opensites] * (1 + 0.1 * demand), np.inf)
+			sortedcost = np.sort(cost, axis=0)
+			with np.errstate(invalid='ignore'):
+				regret = sortedcost[1] - sortedcost[0] \
+					if len(opensites) > 1 else sortedcost[0]
+			# customers without any open arc come last
+			regret = np.where(np.isfinite(sortedcost[0]), regret, -np.inf)
+
+			for j in np.argsort(-regret, kind='stable').tolist():
+				remaining = demand[j]
+				if remaining <= 0:
+					continue
+
+				fitsregular = regular >= remaining
+				fitsslack = regular + slack >= remaining
+				effectivecost = np.where(fitsregular, cost[:, j],
+					np.where(fitsslack, cost[:, j] + 0.25 * remaining, np.inf))
+
+				if np.isfinite(effectivecost).any():
+					order = [int(np.argmin(effectivecost))]
+				else:
+					order = [k for k in np.argsort(cost[:, j]).tolist()
+						if np.isfinite(cost[k, j])]
+
+				for k in order:
+					# never beyond regular and slack capacity left
+					amount = min(remaining, regular[k] + slack[k])
+					if amount <= 0:
+						continue
+					fromregular = min(amount, regular[k])
+					regular[k] -= fromregular
+					slack[k] -= amount - fromregular
+					flow[p, opensites[k], j] += amount
+					remaining -= amount
+					if remaining <= 0:
+						break
+
+		siteindicator = np.zeros(len(self.siteid))
+		siteindicator[opensites] = 1
+		return {'flow': flow, 'siteindicator': siteindicator}
+
+
+	def flowsToSolution(self, dfflow):
+		"""
+		Method to convert flows dataframe in format of
+		extractFlows (e.g. saved from previous run) to
+		solution arrays (see setStart). Rows with unknown
+		period, site or customer ids are ignored.
+		"""
+		periodindex = {pid: p for p, pid in enumerate(self.periodid)}
+		p = dfflow.PeriodID.map(periodindex)
+		i = dfflow.SiteID.map(self.siteindex)
+		j = dfflow.CustomerID.map(self.customerindex)
+		known = p.notna() & i.notna() & j.notna()
+
+		flow = np.zeros((len(self.periodid),) + self.distance.shape)
+		np.add.at(flow, (p[known].astype(int).values,
+			i[known].astype(int).values, j[known].astype(int).values),
+			dfflow.FlowUnits[known].values)
+		return {'flow': flow}
+
+
+	def warmStart(self, dfflow=None):
+		"""
+		Method to load MIP start into built model, either
+		from greedyAssignment or from flows of previous
+		run. Flows on arcs not in model are dropped.
+		args:
+			dfflow: dataframe (optional)
+				Flows in format of extractFlows
+		"""
+		if dfflow is None:
+			solution = self.greedyAssignment()
+		else:
+			solution = self.flowsToSolution(dfflow)
+		self.setStart(solution)
+
+
+	def hasSolution(self):
+		"""
+		Method to check if solved model has
+		a solution available, also when solve
+		stopped on a limit with an incumbent.
+		"""
+		return self.model.SolCount > 0
+
+
+	def getFlowValues(self):
+		"""
+		Method to retrieve values of all flow
+		variables at once.
+		return:
+			flows: array (periods x arcs)
+				Flow values, arcs are ordered as
+				arcsite and arccustomer
+		"""
+		return self.getAttrArray(self.flow).reshape(
+			len(self.periodid), len(self.arcsite))
+
+
+	def extractFlows(self):
+		"""
+		Method to extract non-zero flows from a
+		solved model as a long format dataframe with
+		columns PeriodID, SiteID, CustomerID, 
+		FlowUnits, Distance and ObjectiveValue
+		(objective contribution of flow).
+		"""
+		if not self.hasSolution():
+			print("Model might not have solution available")
+			return FacilityLocationModel.emptyFlows()
+
+		values = self.getFlowValues()
+		periodind, arcind = np.nonzero(values > 0)
+		flow = values[periodind, arcind]
+		siteind = self.arcsite[arcind]
+		customerind = self.arccustomer[arcind]
+		distance = self.distance[siteind, customerind]
+
+		return pd.DataFrame({
+			'PeriodID': np.asarray(self.periodid, dtype=object)[periodind],
+			'SiteID': np.asarray(self.siteid, dtype=object)[siteind],
+			'CustomerID': np.asarray(self.customerid, dtype=object)[customerind],
+			'FlowUnits': flow,
+			'Distance': distance,
+			'ObjectiveValue': 0.1 * distance * flow + distance
+		}, columns=FacilityLocationModel.flowcolumns)
+
+
+	@staticmethod
+	def emptyFlows():
+		"""
+		Method to return dataframe with no flows
+		in format of extractFlows.
+		"""
+		return pd.DataFrame([], columns=FacilityLocationModel.flowcolumns)
+
 
 	def extractSolution(self):
 		"""
@@ -226,24 +1116,22 @@ class FacilityLocationModel:
 		flows from a solved model.
 		"""
 
-		if self.model.status == GRB.Status.SUBOPTIMAL or \
-		self.model.status == GRB.Status.OPTIMAL:
+		if self.hasSolution():
 
-			flows = {}
-			objectivecontri = {}
+			values = self.getFlowValues()
+			distance = self.distance[self.arcsite, self.arccustomer]
+			contribution = 0.1 * distance * values \
+				+ np.where(values > 0, distance, 0)
 
-			for pid in self.periodid:
-				for sid in self.siteid:
-					for cid in self.customerid:
+			keys = [
+				(pid, self.siteid[i], self.customerid[j])
+				for pid in self.periodid
+				for i, j in zip(self.arcsite.tolist(), self.arccustomer.tolist())
+			]
+			flows = dict(zip(keys, values.ravel().tolist()))
+			objectivecontri = dict(zip(keys, contribution.ravel().tolist()))
 
-						flow = self.model.getVarByName(
-							f"flow[{pid},{sid},{cid}]"
-						).X
-						flows[(pid, sid, cid)] = flow
-						objectivecontri[(pid, sid, cid)] = \
-							0.1 * self.servicedist[sid, cid] * flow \
-							+ (self.servicedist[sid, cid] if flow > 0 else 0)
 			return flows, objectivecontri
 		else:
 			print("Model might not have solution available")
-			return {}, {}
\ No newline at end of file
+			return {}, {}
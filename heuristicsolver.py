@@ -0,0 +1,420 @@
+from itertools import combinations
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import milp, LinearConstraint, Bounds
+
+from facilitylocation import FacilityLocationModel
+
+
+class LicenseFreeFacilityLocation(FacilityLocationModel):
+	"""
+	Base class for solvers of FacilityLocationModel
+	problem that do not require Gurobi. Subclasses
+	implement modelProblem, setParameters and solveModel
+	and set flowvalues (periods x sites x customers),
+	objective, lowerbound and gap, so that extractFlows
+	and extractSolution work unchanged.
+	"""
+	def __init__(self, data):
+		super().__init__(data)
+		self.flowvalues = None
+		self.objective = None
+		self.lowerbound = None
+		self.gap = None
+		self.mipgap = 0.01
+		self.timelimit = None
+
+
+	def setCandidateArcs(self, k=None, radius=None, maxpricingrounds=5):
+		"""
+		Candidate arcs rely on arc pricing of Gurobi
+		model, every site x customer pair is kept here.
+		"""
+		if k or radius:
+			raise ValueError(
+				f"Candidate arcs not supported by {type(self).__name__}")
+
+
+	def setParameters(self, mipgap=0.01, timelimit=None):
+		"""
+		Method to set parameters -
+			MIP Gap 1%
+			No time limit (seconds)
+		"""
+		self.mipgap = mipgap
+		self.timelimit = timelimit
+
+
+	def hasSolution(self):
+		return self.flowvalues is not None
+
+
+	def getFlowValues(self):
+		return self.flowvalues[:, self.arcsite, self.arccustomer]
+
+
+	def evaluateFlows(self, flow):
+		"""
+		Method to compute objective of flow plan
+		(periods x sites x customers) with slack
+		capacity used where load exceeds capacity.
+		"""
+		load = flow.sum(axis=2)
+		slack = np.clip(load - self.capacity, 0, self.slackcapacity)
+		return float(
+			(self.distance[None, :, :] * (flow > 0)).sum()
+			+ 0.1 * (self.distance[None, :, :] * flow).sum()
+			+ 0.25 * slack.sum())
+
+
+	def reportGap(self):
+		"""
+		Method to compute and print gap between
+		objective and lower bound.
+		"""
+		if self.objective is not None and self.lowerbound is not None:
+			self.gap = (self.objective - self.lowerbound) \
+				/ max(abs(self.objective), 1e-9)
+		print(f"Objective {self.objective}, lower bound " +\
+			f"{self.lowerbound}, gap {self.gap}")
+
+
+class HighsFacilityLocation(LicenseFreeFacilityLocation):
+	"""
+	Class to solve facility location problem with
+	HiGHS through scipy.optimize.milp, using the big-M
+	formulation of FacilityLocationModel as one sparse
+	constraint matrix.
+	"""
+	def modelProblem(self, exportmps=False, strengthen=False, **kwargs):
+		"""
+		Method to build sparse big-M formulation. Variables
+		are laid out as flow, flowindicator (periods x arcs),
+		serviceindicator (periods x sites), siteindicator
+		(sites) and slackcap (periods x sites).
+		args:
+			strengthen: boolean
+				If true, adds flowindicator <= serviceindicator
+		"""
+		self.buildArrays()
+
+		nperiods, nsites = self.capacity.shape
+		ncustomers = len(self.customerid)
+		narcs = len(self.arcsite)
+		nflows = nperiods * narcs
+		nsiteperiods = nperiods * nsites
+
+		colperiod = np.repeat(np.arange(nperiods), narcs)
+		colarc = np.tile(np.arange(narcs), nperiods)
+		colsite = colperiod * nsites + self.arcsite[colarc]
+		colcustomer = colperiod * ncustomers + self.arccustomer[colarc]
+		arcdist = self.distance[self.arcsite, self.arccustomer][colarc]
+		coldemand = self.demand.ravel()[colcustomer]
+
+		self.c = np.concatenate([
+			0.1 * arcdist, arcdist,
+			np.zeros(nsiteperiods), np.zeros(nsites),
+			np.full(nsiteperiods, 0.25)])
+
+		flowcols = np.arange(nflows)
+		demandmatrix = sp.csr_matrix(
+			(np.ones(nflows), (colcustomer, flowcols)),
+			shape=(nperiods * ncustomers, nflows))
+		capacitymatrix = sp.csr_matrix(
+			(np.ones(nflows), (colsite, flowcols)),
+			shape=(nsiteperiods, nflows))
+		identityflow = sp.identity(nflows, format='csr')
+		identitysite = sp.identity(nsiteperiods, format='csr')
+		siterepeat = sp.csr_matrix(
+			(np.ones(nsiteperiods), (np.arange(nsiteperiods),
+				np.tile(np.arange(nsites), nperiods))),
+			shape=(nsiteperiods, nsites))
+
+		def empty(rows, cols):
+			return sp.csr_matrix((rows, cols))
+
+		blocks = [
+			# demand
+			[demandmatrix, empty(nperiods * ncustomers, nflows),
+				empty(nperiods * ncustomers, nsiteperiods),
+				empty(nperiods * ncustomers, nsites),
+				empty(nperiods * ncustomers, nsiteperiods)],
+			# capacity
+			[capacitymatrix, empty(nsiteperiods, nflows),
+				empty(nsiteperiods, nsiteperiods),
+				empty(nsiteperiods, nsites), -identitysite],
+			# flow <= demand * flowindicator
+			[identityflow, -sp.diags(coldemand, format='csr'),
+				empty(nflows, nsiteperiods), empty(nflows, nsites),
+				empty(nflows, nsiteperiods)],
+			# aggregated service indicator link
+			[capacitymatrix, empty(nsiteperiods, nflows),
+				-sp.diags((self.capacity + self.slackcapacity).ravel(),
+					format='csr'),
+				empty(nsiteperiods, nsites),
+				empty(nsiteperiods, nsiteperiods)],
+			# serviceindicator <= siteindicator
+			[empty(nsiteperiods, nflows), empty(nsiteperiods, nflows),
+				identitysite, -siterepeat,
+				empty(nsiteperiods, nsiteperiods)],
+			# max open sites
+			[empty(1, nflows), empty(1, nflows), empty(1, nsiteperiods),
+				sp.csr_matrix(np.ones((1, nsites))), empty(1, nsiteperiods)],
+		]
+		lower = [
+			self.demand.ravel(), np.full(nsiteperiods, -np.inf),
+			np.full(nflows, -np.inf), np.full(nsiteperiods, -np.inf),
+			np.full(nsiteperiods, -np.inf), [-np.inf]]
+		upper = [
+			self.demand.ravel(), self.capacity.ravel(),
+			np.zeros(nflows), np.zeros(nsiteperiods),
+			np.zeros(nsiteperiods), [self.maxopensites]]
+
+		if strengthen:
+			servicerepeat = sp.csr_matrix(
+				(np.ones(nflows), (flowcols, colsite)),
+				shape=(nflows, nsiteperiods))
+			blocks.append([empty(nflows, nflows), identityflow,
+				-servicerepeat, empty(nflows, nsites),
+				empty(nflows, nsiteperiods)])
+			lower.append(np.full(nflows, -np.inf))
+			upper.append(np.zeros(nflows))
+
+		self.A = sp.bmat(blocks, format='csr')
+		self.constraintlb = np.concatenate(lower)
+		self.constraintub = np.concatenate(upper)
+
+		self.integrality = np.concatenate([
+			np.zeros(nflows), np.ones(nflows),
+			np.ones(nsiteperiods), np.ones(nsites),
+			np.zeros(nsiteperiods)])
+		self.bounds = Bounds(
+			np.zeros(len(self.c)),
+			np.concatenate([
+				np.repeat(np.inf, nflows), np.ones(nflows),
+				np.ones(nsiteperiods), np.ones(nsites),
+				self.slackcapacity.ravel()]))
+
+
+	def solveModel(self):
+		"""
+		Method to call to solve
+		"""
+		options = {'mip_rel_gap': self.mipgap, 'disp': True}
+		if self.timelimit is not None:
+			options['time_limit'] = self.timelimit
+
+		self.result = milp(self.c,
+			constraints=LinearConstraint(
+				self.A, self.constraintlb, self.constraintub),
+			integrality=self.integrality,
+			bounds=self.bounds,
+			options=options)
+
+		if self.result.x is None:
+			print(f"HiGHS did not find solution: {self.result.message}")
+			return
+
+		nperiods = len(self.periodid)
+		narcs = len(self.arcsite)
+		self.flowvalues = np.zeros((nperiods,) + self.distance.shape)
+		self.flowvalues[:, self.arcsite, self.arccustomer] = \
+			self.result.x[:nperiods * narcs].reshape(nperiods, narcs)
+
+		self.objective = self.result.fun
+		self.lowerbound = getattr(self.result, 'mip_dual_bound', None)
+		self.reportGap()
+
+
+class LagrangianFacilityLocation(LicenseFreeFacilityLocation):
+	"""
+	Class to solve facility location problem with
+	Lagrangian relaxation of site capacity constraints.
+
+	For multipliers l (periods x sites), every customer
+	is served in full by the open site minimizing
+		distance + (0.1 * distance + l) * demand
+	and slack is used at its max wherever l > 0.25. Set
+	of open sites minimizing relaxed cost is found by
+	enumerating all sets of maxopensites sites when there
+	are at most maxenumerate of them (otherwise every
+	site is allowed, still a valid bound). Multipliers
+	are updated with subgradient steps.
+
+	Upper bound comes from greedyAssignment on open sites
+	of relaxed solution followed by local search moving
+	customers to cheaper sites with capacity left.
+	"""
+	def modelProblem(self, exportmps=False, **kwargs):
+		self.buildArrays()
+
+
+	def setParameters(self, mipgap=0.01, timelimit=None,
+	maxiterations=200, maxenumerate=1000):
+		"""
+		Method to set parameters -
+			MIP Gap 1%
+			No time limit (seconds)
+			200 subgradient iterations
+			Enumerate up to 1000 site configurations
+		"""
+		super().setParameters(mipgap, timelimit)
+		self.maxiterations = maxiterations
+		self.maxenumerate = maxenumerate
+
+
+	def relaxedOpenSites(self, cost):
+		"""
+		Method to return open sites minimizing sum of
+		relaxed cost (sites x periods*customers) with
+		every customer served by cheapest open site.
+		"""
+		nsites = cost.shape[0]
+		nopen = min(self.maxopensites, nsites)
+		configurations = list(combinations(range(nsites), nopen))
+		if len(configurations) > self.maxenumerate:
+			return np.arange(nsites)
+
+		best, bestvalue = None, np.inf
+		configurations = np.array(configurations, dtype=int)
+		# chunk to limit memory of (configs x open x columns)
+		chunk = max(1, 2**24 // (nopen * cost.shape[1]))
+		for start in range(0, len(configurations), chunk):
+			block = configurations[start:start + chunk]
+			values = cost[block].min(axis=1).sum(axis=1)
+			k = int(np.argmin(values))
+			if values[k] < bestvalue:
+				best, bestvalue = block[k], values[k]
+		return best
+
+
+	def improveAssignment(self, flow, opensites):
+		"""
+		Method to move single sourced customers to a
+		cheaper open site if it has capacity left (at
+		slack cost if needed), one pass per period.
+		"""
+		for p in range(flow.shape[0]):
+			load = flow[p].sum(axis=1)
+			for j in range(flow.shape[2]):
+				assigned = np.nonzero(flow[p, :, j])[0]
+				if len(assigned) != 1:
+					continue
+				a = assigned[0]
+				demand = flow[p, a, j]
+
+				def slackcost(i, amount):
+					over = min(max(load[i] + amount - self.capacity[p, i], 0),
+						self.slackcapacity[p, i]) \
+						- min(max(load[i] - self.capacity[p, i], 0),
+						self.slackcapacity[p, i])
+					return 0.25 * over
+
+				current = self.distance[a, j] * (1 + 0.1 * demand) \
+					- slackcost(a, -demand)
+				for b in opensites:
+					if b == a or load[b] + demand > \
+					self.capacity[p, b] + self.slackcapacity[p, b]:
+						continue
+					moved = self.distance[b, j] * (1 + 0.1 * demand) \
+						+ slackcost(b, demand)
+					if moved < current - 1e-9:
+						flow[p, a, j] = 0
+						flow[p, b, j] = demand
+						load[a] -= demand
+						load[b] += demand
+						a, current = b, moved
+		return flow
+
+
+	def solveModel(self):
+		"""
+		Method to call to solve
+		"""
+		start = time.time()
+		nperiods, nsites = self.capacity.shape
+		ncustomers = len(self.customerid)
+
+		distance = self.distance
+		multipliers = np.zeros((nperiods, nsites))
+		step = 2.0
+		stalled = 0
+		upperbounds = {}
+
+		for iteration in range(self.maxiterations):
+			# relaxed cost of serving customer in full (sites x periods x customers)
+			cost = distance[:, None, :] \
+				+ (0.1 * distance[:, None, :] + multipliers.T[:, :, None]) \
+				* self.demand[None, :, :]
+			cost = np.where(self.demand[None, :, :] > 0, cost, 0)
+
+			opensites = self.relaxedOpenSites(
+				cost.reshape(nsites, nperiods * ncustomers))
+			choice = opensites[np.argmin(cost[opensites], axis=0)]
+			slack = np.where(multipliers > 0.25, self.slackcapacity, 0)
+
+			bound = float(np.take_along_axis(
+				cost, choice[None, :, :], axis=0).sum()
+				+ ((0.25 - multipliers) * slack).sum()
+				- (multipliers * self.capacity).sum())
+			if self.lowerbound is None or bound > self.lowerbound + 1e-9:
+				self.lowerbound = bound
+				stalled = 0
+			else:
+				stalled += 1
+				if stalled >= 10:
+					step /= 2
+					stalled = 0
+
+			# upper bound from open sites of relaxed solution
+			key = tuple(sorted(set(choice.ravel().tolist())))
+			if len(key) > self.maxopensites:
+				# sites serving most demand in relaxed solution
+				served = np.bincount(choice.ravel(),
+					weights=self.demand.ravel(), minlength=nsites)
+				key = tuple(sorted(np.argsort(-served, kind='stable')[
+					:self.maxopensites].tolist()))
+			if key not in upperbounds:
+				flow = self.improveAssignment(
+					self.greedyAssignment(np.array(key))['flow'], key)
+				if np.allclose(flow.sum(axis=1), self.demand):
+					upperbounds[key] = self.evaluateFlows(flow)
+					if self.objective is None or \
+					upperbounds[key] < self.objective:
+						self.objective = upperbounds[key]
+						self.flowvalues = flow
+				else:
+					upperbounds[key] = None
+
+			if self.objective is not None and self.lowerbound > 0 and \
+			(self.objective - self.lowerbound) / self.objective <= self.mipgap:
+				break
+			if self.timelimit is not None and \
+			time.time() - start > self.timelimit:
+				break
+
+			# subgradient of relaxed capacity constraints
+			load = np.zeros((nperiods, nsites))
+			periods = np.repeat(np.arange(nperiods), ncustomers)
+			np.add.at(load, (periods, choice.ravel()), self.demand.ravel())
+			subgradient = load - self.capacity - slack
+			norm = (subgradient**2).sum()
+			if norm == 0:
+				break
+			target = self.objective if self.objective is not None \
+				else 1.05 * abs(bound) + 1
+			multipliers = np.maximum(0, multipliers
+				+ step * (target - bound) / norm * subgradient)
+
+		self.iterations = iteration + 1
+		self.reportGap()
+
+
+# license free and gurobi solvers by name
+solvers = {
+	'gurobi': FacilityLocationModel,
+	'highs': HighsFacilityLocation,
+	'lagrangian': LagrangianFacilityLocation,
+}
@@ -1,14 +1,101 @@
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 import os
-from math import radians, cos, sin, acos, asin
 
+from distance import GreatCircleProvider, EARTHRADIUS
 from routeflows import RouteFlows
 from facilitylocation import FacilityLocationModel
+from heuristicsolver import solvers
+from decomposition import PeriodDecomposition
 
 class CapEx:
-	def __init__(self, filename='InputData - Copy.xlsx'):
-		
+	def __init__(self, filename='InputData - Copy.xlsx',
+	candidatek=None, candidateradius=None, decomposition=None,
+	warmstart=None, solver='gurobi', aggregationtolerance=None,
+	aggregationmethod='location', distancecache=None,
+	distancecachebudget=None, distanceprovider=None,
+	incrementalclustering=False, clustertiles=None,
+	routeallperiods=False):
+		'''
+		kwargs:
+			candidatek: int
+				If set, flow model only keeps arcs to 
+				candidatek nearest sites of customer
+			candidateradius: int/float
+				If set, flow model only keeps arcs to
+				sites within candidateradius miles 
+				(and nearest site) of customer
+			decomposition: str
+				If set, flows are created by solving
+				single period subproblems in parallel
+				(see PeriodDecomposition), either
+				'enumerate' or 'localsearch'
+			warmstart: str
+				If 'greedy', flow model is warm started
+				from greedy assignment heuristic. Any 
+				other value is read as csv file of flows
+				from previous run to warm start from.
+			solver: str
+				Solver for flow model, one of 'gurobi',
+				'highs' or 'lagrangian'. Latter two do
+				not require a Gurobi license.
+				Candidate arcs, decomposition and
+				warmstart are only supported by
+				'gurobi' solver
+			aggregationtolerance: int/float
+				If set, customers are merged into demand 
+				points (see aggregateCustomers) within 
+				this tolerance in miles before solving 
+				flow model, flows are split back after
+			aggregationmethod: str
+				'location' or 'distance'
+			distancecache: str
+				If set, directory of persistent distance
+				cache used for routing
+			distancecachebudget: int
+				If set, memory budget in bytes of
+				per site distance blocks reused across
+				periods in routing (with routeallperiods)
+			distanceprovider: object
+				Provider of site to customer and routing
+				distances, e.g. roadnetwork.RoadNetworkProvider
+				for driving distances from a local road
+				graph. Great circle if not provided.
+			incrementalclustering: boolean
+				If true, routing clusters of a site are
+				repaired from previous period's clusters
+				instead of being rebuilt every period
+				(with routeallperiods)
+			clustertiles: int
+				If set, customers of a site are split
+				into this many spatial tiles clustered
+				in parallel before routing
+			routeallperiods: boolean
+				If true, flows of every period are
+				routed, otherwise first period only
+		'''
+		if solver != 'gurobi' and (candidatek or candidateradius):
+			raise ValueError(
+				f"Candidate arcs not supported by solver {solver}")
+		if solver != 'gurobi' and decomposition:
+			raise ValueError(
+				f"Decomposition not supported by solver {solver}")
+
+		self.candidatek = candidatek
+		self.candidateradius = candidateradius
+		self.decomposition = decomposition
+		self.warmstart = warmstart
+		self.solver = solver
+		self.aggregationtolerance = aggregationtolerance
+		self.aggregationmethod = aggregationmethod
+		self.distancecache = distancecache
+		self.distancecachebudget = distancecachebudget
+		self.distanceprovider = distanceprovider or GreatCircleProvider()
+		self.incrementalclustering = incrementalclustering
+		self.clustertiles = clustertiles
+		self.routeallperiods = routeallperiods
+
 		self.readData(filename)
 		self.processData()
 
@@ -101,93 +188,229 @@ class CapEx:
 
 		self.computeServiceDistances()
 
+		if self.aggregationtolerance is not None:
+			self.aggregateCustomers()
+
 
 	def computeServiceDistances(self):
 		'''Method computes distance between
-		facilities and customers using great
-		circle distance formula'''
-
-		self.serviceDist = {}
-		for sid in self.siteID:
-			lat1 = radians(self.siteLat[sid])
-			lon1 = radians(self.siteLon[sid])
-			for cid in self.customerID:
-				lat2 = radians(self.customerLat[cid])
-				lon2 = radians(self.customerLon[cid])
-
-				# radius of earth in miles - 3958.75
-				self.serviceDist[(sid, cid)] = round(3958.75 * (
-					acos(sin(lat1)*sin(lat2) \
-						+ cos(lat1)*cos(lat2)*cos(lon1-lon2))), 
-					2)
+		facilities and customers with distance
+		provider, great circle by default'''
+
+		matrix = self.distanceprovider.matrix(
+			[self.siteLat[sid] for sid in self.siteID],
+			[self.siteLon[sid] for sid in self.siteID],
+			[self.customerLat[cid] for cid in self.customerID],
+			[self.customerLon[cid] for cid in self.customerID])
+
+		self.serviceDist = dict(zip(
+			[(sid, cid) for sid in self.siteID for cid in self.customerID],
+			matrix.ravel().tolist()))
+
+
+	def aggregateCustomers(self):
+		'''Method merges customers into demand points to
+		shrink flow model. With aggregationmethod 'location'
+		customers in same grid cell of diagonal equal to 
+		aggregationtolerance miles are merged, with 'distance'
+		customers whose distances to every site fall in same
+		aggregationtolerance wide bins are merged.
+
+		Distance of demand point to site is demand weighted
+		mean of its customers' distances, so no customer is 
+		more than aggregationError miles off from its demand 
+		point's distance to any site.'''
+		tolerance = self.aggregationtolerance
+		customers = pd.DataFrame({'CustomerID': self.customerID})
+		distance = np.array([[self.serviceDist[sid, cid] 
+			for sid in self.siteID] for cid in self.customerID])
+
+		if self.aggregationmethod == 'location':
+			lat = customers.CustomerID.map(self.customerLat).values
+			lon = customers.CustomerID.map(self.customerLon).values
+			# miles per degree on a local projection
+			milesperdeg = EARTHRADIUS * np.pi / 180
+			y = lat * milesperdeg
+			x = lon * milesperdeg * np.cos(np.radians(lat.mean()))
+			cell = tolerance / np.sqrt(2)
+			keys = np.stack([np.floor(x / cell), np.floor(y / cell)], axis=1)
+		elif self.aggregationmethod == 'distance':
+			keys = np.floor(distance / tolerance)
+		else:
+			raise ValueError(
+				f"Unknown aggregation method {self.aggregationmethod}")
+
+		# first customer of group represents demand point
+		_, first, group = np.unique(keys, axis=0, 
+			return_index=True, return_inverse=True)
+		group = group.ravel()
+		customers['DemandPointID'] = np.array(
+			self.customerID, dtype=object)[first][group]
+
+		# demand by customer and period
+		demand = np.array([[self.customerDemByPeriod[pid].get(cid, 0)
+			for pid in self.periodID] for cid in self.customerID])
+		weight = demand.sum(axis=1) + 1e-9
+
+		groupweight = np.bincount(group, weights=weight)
+		pointdistance = np.stack([
+			np.bincount(group, weights=weight * distance[:, i]) 
+			for i in range(len(self.siteID))], axis=1) \
+			/ groupweight[:, None]
+
+		self.demandPointID = np.array(
+			self.customerID, dtype=object)[first].tolist()
+		self.demandPointDist = {
+			(sid, pointid): round(pointdistance[k, i], 2)
+			for k, pointid in enumerate(self.demandPointID)
+			for i, sid in enumerate(self.siteID)
+		}
+		self.demandPointDemByPeriod = {
+			pid: dict(zip(self.demandPointID, 
+				np.bincount(group, weights=demand[:, p]).tolist()))
+			for p, pid in enumerate(self.periodID)
+		}
+		self.demandPointMembers = customers
+
+		# error bounds
+		error = np.abs(distance - pointdistance[group])
+		self.aggregationError = error.max() if len(error) else 0
+		membercount = np.bincount(group)
+		fixedbound = len(self.periodID) * ((membercount - 1) \
+			* pointdistance.max(axis=1) + membercount \
+			* self.aggregationError).sum()
+		variablebound = 0.1 * self.aggregationError * demand.sum()
+		self.aggregationObjectiveError = fixedbound + variablebound
+
+		print(f"Aggregated {len(self.customerID)} customers into " +\
+			f"{len(self.demandPointID)} demand points, distance error " +\
+			f"bound {self.aggregationError:.2f} miles, objective " +\
+			f"error bound {self.aggregationObjectiveError:.2f}")
+
+
+	def disaggregateFlows(self, df_flow):
+		'''Method splits flows of demand points back to their
+		customers in proportion to customers' demand in that
+		period, meeting every customer's demand exactly. 
+		Distance and objective value are computed with
+		customers' own distances.'''
+		members = self.demandPointMembers.rename(
+			columns={'CustomerID': 'MemberID'})
+		df = df_flow.rename(columns={'CustomerID': 'DemandPointID'}
+			).merge(members, on='DemandPointID')
+
+		memberdemand = [self.customerDemByPeriod[pid].get(cid, 0)
+			for pid, cid in zip(df.PeriodID, df.MemberID)]
+		pointdemand = [self.demandPointDemByPeriod[pid][dpid]
+			for pid, dpid in zip(df.PeriodID, df.DemandPointID)]
+		df['FlowUnits'] = df.FlowUnits * np.array(memberdemand) \
+			/ np.array(pointdemand)
+		df = df[df.FlowUnits > 0]
+
+		distance = np.array([self.serviceDist[sid, cid]
+			for sid, cid in zip(df.SiteID, df.MemberID)])
+		return pd.DataFrame({
+			'PeriodID': df.PeriodID.values,
+			'SiteID': df.SiteID.values,
+			'CustomerID': df.MemberID.values,
+			'FlowUnits': df.FlowUnits.values,
+			'Distance': distance,
+			'ObjectiveValue': 0.1 * distance * df.FlowUnits.values \
+				+ distance
+		}, columns=FacilityLocationModel.flowcolumns)
 
 
 	def createFlows(self):
-		flm = FacilityLocationModel(
-			{
-				'periodid': self.periodID,
-				'siteid': self.siteID,
-				'customerid': self.customerID,
-				'sitecapbyperiod': self.siteCapByPeriod,
-				'siteslackcapbyperiod': self.siteSlackCapByPeriod,
-				'customerdembyperiod': self.customerDemByPeriod,
-				'servicedist': self.serviceDist,
-				'maxopensites': 4
-			}
-		)
+		if self.aggregationtolerance is None:
+			return self.solveFlows(self.customerID, 
+				self.customerDemByPeriod, self.serviceDist)
+
+		df_flow = self.solveFlows(self.demandPointID,
+			self.demandPointDemByPeriod, self.demandPointDist)
+		return self.disaggregateFlows(df_flow)
+
+
+	def solveFlows(self, customerid, customerdembyperiod, servicedist):
+		data = {
+			'periodid': self.periodID,
+			'siteid': self.siteID,
+			'customerid': customerid,
+			'sitecapbyperiod': self.siteCapByPeriod,
+			'siteslackcapbyperiod': self.siteSlackCapByPeriod,
+			'customerdembyperiod': customerdembyperiod,
+			'servicedist': servicedist,
+			'maxopensites': 4
+		}
+
+		if self.decomposition:
+			decomposition = PeriodDecomposition(data,
+				buildoptions={'matrixapi': True})
+			opensites, objective, df_flow = decomposition.solve(
+				method=self.decomposition)
+			if df_flow is None:
+				return FacilityLocationModel.emptyFlows()
+			print(f"Open sites {sorted(opensites, key=str)}, " +\
+				f"objective {objective}")
+			return df_flow
+
+		flm = solvers[self.solver](data)
+		if self.candidatek or self.candidateradius:
+			flm.setCandidateArcs(self.candidatek, self.candidateradius)
 		flm.modelProblem()
 		flm.setParameters()
+		if self.warmstart and self.solver != 'gurobi':
+			print(f"Warm start not supported by solver {self.solver}, " +\
+				"ignored")
+		elif self.warmstart == 'greedy':
+			flm.warmStart()
+		elif self.warmstart:
+			flm.warmStart(pd.read_csv(self.warmstart))
 		flm.solveModel()
-		flows, objectiveval = flm.extractSolution()
-		return flows, objectiveval
+		return flm.extractFlows()
 
 
 	def solve(self):
 
-		flows, flowcost = self.createFlows()
-
-		flowrows = []
-		pathrows = []
 		clusters = []
 		routes = []
 		routepaths = []
 
 		scid = self.scenarioID[0]
 
-		for key, flow in flows.items():
-			if flow > 0:
-				pid, sid, cid = key
-
-				# flows
-				flowrows.append(
-					[scid, pid, sid, cid, flow, 
-					self.serviceDist[sid, cid], 
-					flowcost.get(key)]
-				)
-
-				# paths
-				pathid = "_".join([str(id_) for id_ in key])
-
-				pathrows.append(
-					[scid, pathid, pid, 'Site', 
-					sid, self.siteLat[sid], 
-					self.siteLon[sid], flow]
-				)
-				pathrows.append(
-					[scid, pathid, pid, 'Customer', 
-					cid, self.customerLat[cid], 
-					self.customerLon[cid], flow]
-				)
-		df_flow = CapEx.putInDataFrame(
-			flowrows, datafor='flows')
-		df_path = CapEx.putInDataFrame(
-			pathrows, datafor='flowpaths')
+		# flows
+		df_flow = self.createFlows()
+		df_flow.insert(0, 'ScenarioID', scid)
+
+		# paths, a site row followed by a customer row per flow
+		pathid = df_flow.PeriodID.astype(str) + "_" \
+			+ df_flow.SiteID.astype(str) + "_" \
+			+ df_flow.CustomerID.astype(str)
+		df_sitepath = pd.DataFrame({
+			'ScenarioID': scid, 'PathID': pathid,
+			'PeriodID': df_flow.PeriodID, 'LocationType': 'Site',
+			'LocationID': df_flow.SiteID,
+			'Latitude': df_flow.SiteID.map(self.siteLat),
+			'Longitude': df_flow.SiteID.map(self.siteLon),
+			'FlowUnits': df_flow.FlowUnits})
+		df_customerpath = pd.DataFrame({
+			'ScenarioID': scid, 'PathID': pathid,
+			'PeriodID': df_flow.PeriodID, 'LocationType': 'Customer',
+			'LocationID': df_flow.CustomerID,
+			'Latitude': df_flow.CustomerID.map(self.customerLat),
+			'Longitude': df_flow.CustomerID.map(self.customerLon),
+			'FlowUnits': df_flow.FlowUnits})
+		df_path = pd.concat([df_sitepath, df_customerpath]
+			).sort_index(kind='stable').reset_index(drop=True)
 
 		routeflows = RouteFlows(
 			self.siteLat, self.siteLon,
 			self.customerLat, self.customerLon,
 			self.siteID, self.customerID,
-			7, 700
+			7, 700, cachedir=self.distancecache,
+			cachebudget=self.distancecachebudget,
+			provider=self.distanceprovider,
+			incremental=self.incrementalclustering,
+			tiles=self.clustertiles
 		)
 		for pid in self.periodID:
 			cluster_pid, route_pid, routepaths_pid = \
@@ -199,7 +422,8 @@ class CapEx:
 			clusters.extend(cluster_pid)
 			routes.extend(route_pid)
 			routepaths.extend(routepaths_pid)
-			break
+			if not self.routeallperiods:
+				break
 
 		df_clusters = CapEx.putInDataFrame(
 			clusters, datafor='clusters')
@@ -1,3 +1,9 @@
+from array import array
+import heapq
+
+import numpy as np
+
+
 class Graph:
 	"""
 	Class to setup graph and create cluster(s)/tree(s)
@@ -8,6 +14,9 @@ class Graph:
 	def __init__(self, vertices, nodeweights):
 		self.V = vertices
 		self.graph = []
+		self.edgestreams = []
+		self.edgesexamined = 0
+		self.edgesskipped = 0
 
 		self.makeSet(nodeweights)
 
@@ -16,6 +25,31 @@ class Graph:
 		'''
 		Method to add graph edges.
 		'''
+		self.checkEdge(u, v, w)
+		self.graph.append((u,v,w))
+
+
+	def addEdgeStream(self, edges):
+		'''
+		Method to add iterator or generator of 
+		(u, v, w) edges in non decreasing weight 
+		order, e.g. popping from a heap. Edges are
+		only generated as kruskal's consumes them,
+		so those after early termination are never 
+		produced.
+		'''
+		def checked(edges):
+			for u, v, w in edges:
+				self.checkEdge(u, v, w)
+				yield (u, v, w)
+
+		self.edgestreams.append(checked(edges))
+
+
+	def checkEdge(self, u, v, w):
+		'''
+		Method to validate edge end nodes and weight
+		'''
 		if self.nodeweightsum.get(u) == None or \
 			self.nodeweightsum.get(v) == None:
 			# bad argument 
@@ -24,9 +58,7 @@ class Graph:
 				" Skipping edge.."
 			)
 
-		if isinstance(w, int) or isinstance(w, float):
-			self.graph.append((u,v,w))
-		else:
+		if not (isinstance(w, int) or isinstance(w, float)):
 			raise TypeError(
 				f"Arc weight {w} must be either float or int"
 			)
@@ -131,13 +163,45 @@ class Graph:
 		'''
 		Method to execute modified Kruskal's
 		algorithm to create cluster(s)/tree(s)
+
+		Edges are consumed lazily in weight order
+		from a heap of added edges (ties in order 
+		added) merged with edge streams, and scan
+		stops at first edge heavier than arc limit
+		(it can never be accepted) or once all nodes 
+		are in one tree. Counters edgesexamined and
+		edgesskipped (added or already streamed edges 
+		left unexamined) are set. Routing clusters with
+		ArrayGraph.mstKruskal, which sets same counters.
 		'''
 		result = []
+		trees = len(self.V)
+		self.edgesexamined = 0
+		generated = [0]
+
+		heap = [(w, k, u, v) for k, (u, v, w) in enumerate(self.graph)]
+		heapq.heapify(heap)
+
+		def popped():
+			while heap:
+				w, _, u, v = heapq.heappop(heap)
+				generated[0] += 1
+				yield (u, v, w)
 
-		# sort edges based on their weight
-		self.graph = sorted(self.graph, key=lambda e: e[2])
+		def counted(edges):
+			for edge in edges:
+				generated[0] += 1
+				yield edge
+
+		edges = heapq.merge(popped(), 
+			*[counted(stream) for stream in self.edgestreams],
+			key=lambda e: e[2])
+
+		for u,v,w in edges:
+			if w > maxtreearcswt or trees <= 1:
+				break
+			self.edgesexamined += 1
 
-		for u,v,w in self.graph:
 			if self.findSet(u) != self.findSet(v):
 				# u and v belong to separate trees
 
@@ -153,7 +217,10 @@ class Graph:
 
 					result.append((u,v,w))
 					self.union(u, v, w)
+					trees -= 1
 
+		self.edgesskipped = len(heap) + generated[0] - self.edgesexamined
+		self.edgestreams = []
 		return result
 
 
@@ -196,6 +263,233 @@ class Graph:
 		return clusters
 
 
+class ArrayGraph:
+	"""
+	Class with same clusters/trees as Graph, but storing
+	nodes as integer indices into vertices and union-find
+	state (parent, rank, arc and node weight sums) in
+	arrays instead of dictionaries. Edges are added in
+	bulk as arrays and representatives are found without
+	recursion (path halving), so deep trees are safe.
+	"""
+	def __init__(self, vertices, nodeweights, default_weight=0):
+		self.V = list(vertices)
+		self.index = {vertex: k for k, vertex in enumerate(self.V)}
+		n = len(self.V)
+
+		weights = []
+		for v in self.V:
+			if nodeweights.get(v) == None:
+				print(f"Node {v} missing weight, " + \
+					f"assigning default {default_weight} weight")
+				nodeweights[v] = default_weight
+			weights.append(nodeweights[v])
+
+		self.parent = array('q', range(n))
+		self.rank = array('q', bytes(8 * n))
+		self.arcweightsum = array('d', bytes(8 * n))
+		self.nodeweightsum = array('d', weights)
+
+		self.u = np.array([], dtype=np.intp)
+		self.v = np.array([], dtype=np.intp)
+		self.w = np.array([], dtype=np.float64)
+		self.accepted = []
+		self.edgesexamined = 0
+		self.edgesskipped = 0
+
+
+	def addEdges(self, u, v, w):
+		'''
+		Method to add graph edges in bulk.
+		args:
+			u, v: array like of int
+				Indices of edge end nodes in vertices
+			w: array like of int/float
+				Arc weights
+		'''
+		u = np.asarray(u, dtype=np.intp)
+		v = np.asarray(v, dtype=np.intp)
+		w = np.asarray(w)
+		if not (len(u) == len(v) == len(w)):
+			raise ValueError("Edge arrays must have same length")
+		if len(w) and not np.issubdtype(w.dtype, np.number):
+			raise TypeError(
+				"Arc weights must be either float or int"
+			)
+		n = len(self.V)
+		if len(u) and (min(u.min(), v.min()) < 0 or \
+		max(u.max(), v.max()) >= n):
+			raise KeyError("Edge node index out of vertices range")
+
+		self.u = np.concatenate([self.u, u])
+		self.v = np.concatenate([self.v, v])
+		self.w = np.concatenate([self.w, w.astype(np.float64)])
+
+
+	def addTrees(self, u, v, w):
+		'''
+		Method to add edges of trees already built
+		(e.g. clustered separately), accepted as they
+		are without checking limits. Kruskal's then
+		only grows these trees.
+		'''
+		start = len(self.w)
+		self.addEdges(u, v, w)
+		for k in range(start, len(self.w)):
+			x = self.findSet(int(self.u[k]))
+			y = self.findSet(int(self.v[k]))
+			if x != y:
+				self.union(x, y, float(self.w[k]))
+				self.accepted.append(k)
+
+
+	def roots(self):
+		'''
+		Method to return array of representative
+		node index of every node
+		'''
+		return np.fromiter((self.findSet(x) for x in range(len(self.V))),
+			dtype=np.intp, count=len(self.V))
+
+
+	def mergeable(self, u, v, w, maxtreearcswt, maxtreenodeswt):
+		'''
+		Method to return boolean array of edges (node
+		index arrays u, v and weights w) joining two 
+		trees that are still within limits if merged.
+		Tree weights only grow, so other edges can
+		never be accepted and need not be added.
+		'''
+		roots = self.roots()
+		arcs = np.frombuffer(self.arcweightsum)[roots]
+		nodes = np.frombuffer(self.nodeweightsum)[roots]
+		return (roots[u] != roots[v]) \
+			& (arcs[u] + arcs[v] + w <= maxtreearcswt) \
+			& (nodes[u] + nodes[v] <= maxtreenodeswt)
+
+
+	def addEdge(self, u, v, w):
+		'''
+		Method to add single graph edge between
+		vertices u and v (labels, not indices).
+		'''
+		index = self.index
+		if u not in index or v not in index:
+			raise KeyError(
+				f"Either {u} or {v} do not belong in vertices." +\
+				" Skipping edge.."
+			)
+		self.addEdges([index[u]], [index[v]], [w])
+
+
+	def findSet(self, x):
+		'''
+		Method to find and return index of the
+		representative node for cluster/tree
+		containing node index x
+		'''
+		parent = self.parent
+		while parent[x] != x:
+			parent[x] = parent[parent[x]]
+			x = parent[x]
+		return x
+
+
+	def union(self, x, y, w):
+		'''
+		Method to union two clusters/trees with
+		representatives x and y through edge of
+		weight w, by rank
+		'''
+		arcs, nodes = self.arcweightsum, self.nodeweightsum
+		if self.rank[x] > self.rank[y]:
+			arcs[x] = arcs[x] + arcs[y] + w
+			nodes[x] = nodes[x] + nodes[y]
+			self.parent[y] = x
+		else:
+			arcs[y] = arcs[y] + arcs[x] + w
+			nodes[y] = nodes[y] + nodes[x]
+			self.parent[x] = y
+			if self.rank[x] == self.rank[y]:
+				self.rank[y] += 1
+
+
+	def mstKruskal(self, maxtreearcswt, maxtreenodeswt):
+		'''
+		Method to execute modified Kruskal's
+		algorithm to create cluster(s)/tree(s),
+		stopping early as in Graph.mstKruskal. Sets
+		counters edgesexamined and edgesskipped 
+		(edges left unscanned), reported by 
+		RouteFlows.clusterizeCustomers.
+		return:
+			result: array of indices of accepted edges
+		'''
+		result = []
+		arcs, nodes = self.arcweightsum, self.nodeweightsum
+		findSet = self.findSet
+		trees = len(self.V) - len(self.accepted)
+		self.edgesexamined = 0
+
+		# stable, ties keep order edges were added in, 
+		# edges heavier than arc limit are never scanned
+		order = np.argsort(self.w, kind='stable')
+		order = order[:np.searchsorted(self.w[order], maxtreearcswt,
+			side='right')]
+		for k, u, v, w in zip(order.tolist(), self.u[order].tolist(),
+		self.v[order].tolist(), self.w[order].tolist()):
+			if trees <= 1:
+				break
+			self.edgesexamined += 1
+
+			x, y = findSet(u), findSet(v)
+			if x != y:
+				if (arcs[x] + arcs[y] + w <= maxtreearcswt) and \
+				(nodes[x] + nodes[y] <= maxtreenodeswt):
+					result.append(k)
+					self.union(x, y, w)
+					trees -= 1
+
+		self.edgesskipped = len(self.w) - self.edgesexamined
+		return np.array(self.accepted + result, dtype=np.intp)
+
+
+	def getClusters(self, maxtreearcswt, maxtreenodeswt):
+		'''
+		Method to call modified kruskal's and 
+		retrive cluster(s)/tree(s) in same format
+		as Graph.getClusters, keyed by vertex labels
+		'''
+		clusters = {}
+		connected = [False] * len(self.V)
+		V = self.V
+
+		resultedges = self.mstKruskal(maxtreearcswt, maxtreenodeswt)
+		for u, v, w in zip(self.u[resultedges].tolist(),
+		self.v[resultedges].tolist(), self.w[resultedges].tolist()):
+			p = V[self.findSet(u)]
+
+			if clusters.get(p) == None:
+				clusters[p] = {'arcs':[]}
+
+			clusters[p]['arcs'].append((V[u], V[v], w))
+
+			connected[u] = True
+			connected[v] = True
+
+		# for single node trees/clusters, if any
+		for node, status in enumerate(connected):
+			if status == False:
+				clusters[V[node]] = {'arcs': []}
+
+		for rep in clusters.keys():
+			root = self.findSet(self.index[rep])
+			clusters[rep]['treearcweight'] = self.arcweightsum[root]
+			clusters[rep]['treenodeweight'] = self.nodeweightsum[root]
+
+		return clusters
+
+
 
 def prettyPrint(nesteddict, indent=0):
 	'''
@@ -0,0 +1,152 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+
+from distance import haversine
+from spatial import SpatialIndex
+
+
+class RoadNetworkProvider:
+	"""
+	Class to provide driving distance matrices between
+	locations from a local road graph, fully offline.
+
+	Road graph is read from two csv files, e.g. an OSM
+	extract converted to an edge list -
+		nodes: columns node, lat, lon
+		edges: columns source, target, length (miles)
+	and stored as a CSR matrix. Locations are snapped
+	to their nearest road node, and many-to-many tables
+	are computed with multi-source Dijkstra, a block of
+	source nodes at a time. Distance of a pair is
+	access leg to road + road distance + leg from road.
+	"""
+	def __init__(self, nodesfile, edgesfile, directed=False,
+	blocksize=256, blockmemory=2**28):
+		"""
+		args:
+			nodesfile, edgesfile: str
+				Paths of node and edge csv files
+			directed: boolean
+				If false, every edge can be driven
+				both ways
+			blocksize: int
+				Max number of source nodes per
+				Dijkstra call
+			blockmemory: int
+				Bytes of temporary memory per Dijkstra
+				call, which returns distances to every
+				road node (8 bytes per source and node),
+				caps number of source nodes further
+		"""
+		self.nodesfile = nodesfile
+		self.edgesfile = edgesfile
+		self.directed = directed
+		self.blockmemory = blockmemory
+
+		nodes = pd.read_csv(nodesfile)
+		edges = pd.read_csv(edgesfile)
+
+		nodeindex = {node: k for k, node in enumerate(nodes.node)}
+		source = edges.source.map(nodeindex).values
+		target = edges.target.map(nodeindex).values
+		if np.isnan(source.astype(float)).any() or \
+		np.isnan(target.astype(float)).any():
+			raise KeyError("Edges refer to nodes missing in nodes file")
+
+		n = len(nodes)
+		graph = sp.coo_matrix((edges.length.values.astype(np.float64),
+			(source.astype(np.intp), target.astype(np.intp))), shape=(n, n))
+		# csr conversion would sum parallel edges
+		self.graph = self.dedupe(graph).tocsr()
+		# dijkstra returns dense rows over all road nodes
+		self.blocksize = max(1, min(blocksize, blockmemory // (8 * max(n, 1))))
+
+		self.nodes = SpatialIndex(nodes.node.tolist(),
+			nodes.lat.values, nodes.lon.values)
+
+
+	@staticmethod
+	def dedupe(graph):
+		"""
+		Method to keep shortest of parallel edges
+		"""
+		keys = graph.row.astype(np.int64) * graph.shape[1] + graph.col
+		order = np.lexsort((graph.data, keys))
+		keys, first = np.unique(keys[order], return_index=True)
+		data = graph.data[order][first]
+		return sp.coo_matrix((data, (keys // graph.shape[1],
+			keys % graph.shape[1])), shape=graph.shape)
+
+
+	def snap(self, lat, lon):
+		"""
+		Method to return nearest road node index and
+		great circle distance to it for every location.
+		"""
+		distance, index = self.nodes.knn(lat, lon, 1)
+		return index[:, 0], distance[:, 0]
+
+
+	def matrix(self, lat1, lon1, lat2=None, lon2=None,
+	dtype=np.float64, decimals=2, out=None):
+		"""
+		Method to compute driving distances between every
+		pair of two sets of points (rows lat1, lon1 and
+		columns lat2, lon2, or rows again if not provided).
+		Locations snapped to same node, or not connected by
+		road, get great circle distance.
+		"""
+		lat1 = np.asarray(lat1, dtype=np.float64)
+		lon1 = np.asarray(lon1, dtype=np.float64)
+		if lat2 is None:
+			lat2, lon2 = lat1, lon1
+		lat2 = np.asarray(lat2, dtype=np.float64)
+		lon2 = np.asarray(lon2, dtype=np.float64)
+
+		rownode, rowaccess = self.snap(lat1, lon1)
+		colnode, colaccess = self.snap(lat2, lon2)
+
+		matrix = out if out is not None \
+			else np.empty((len(lat1), len(lat2)), dtype=dtype)
+
+		# one Dijkstra per distinct source node
+		sources, rowsource = np.unique(rownode, return_inverse=True)
+		rowsource = rowsource.ravel()
+		for start in range(0, len(sources), self.blocksize):
+			block = sources[start:start + self.blocksize]
+			road = dijkstra(self.graph, directed=self.directed,
+				indices=block)[:, colnode]
+
+			rows = np.nonzero((rowsource >= start)
+				& (rowsource < start + len(block)))[0]
+			values = rowaccess[rows, None] \
+				+ road[rowsource[rows] - start] + colaccess[None, :]
+
+			direct = haversine(lat1[rows, None], lon1[rows, None],
+				lat2[None, :], lon2[None, :])
+			fallback = ~np.isfinite(values) \
+				| (rownode[rows, None] == colnode[None, :])
+			values = np.where(fallback, direct, values)
+
+			if decimals is not None:
+				values = np.round(values, decimals)
+			matrix[rows] = values
+		return matrix
+
+
+	def signature(self):
+		"""
+		Method to return string identifying road graph
+		files and their versions, used in cache keys.
+		"""
+		digest = hashlib.sha1()
+		for path in [self.nodesfile, self.edgesfile]:
+			stat = os.stat(path)
+			digest.update(f"{os.path.abspath(path)}:{stat.st_size}:" \
+				f"{stat.st_mtime_ns}".encode())
+		return f"roadnetwork:{self.directed}:{digest.hexdigest()}"
@@ -0,0 +1,145 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from distance import EARTHRADIUS, haversine
+
+# miles per degree of latitude
+MILESPERDEGREE = EARTHRADIUS * np.pi / 180
+
+
+class SpatialIndex:
+	"""
+	Class to answer nearest neighbor and close pair
+	queries over a set of locations with a KD-tree on locally
+	projected (equirectangular, miles) coordinates.
+
+	Projection is accurate within a city, and pair
+	queries are widened slightly and then filtered
+	with great circle distance, so they are exact.
+	"""
+	def __init__(self, ids, lat, lon, reflat=None):
+		"""
+		args:
+			ids: list of location ids
+			lat, lon: array like of coordinates in
+				same order as ids
+			reflat: float (optional)
+				Latitude of projection, mean latitude
+				of locations if not provided
+		"""
+		self.ids = list(ids)
+		self.lat = np.asarray(lat, dtype=np.float64)
+		self.lon = np.asarray(lon, dtype=np.float64)
+		self.reflat = float(self.lat.mean()) if reflat is None \
+			and len(self.lat) else (reflat or 0.0)
+		self.tree = cKDTree(self.project(self.lat, self.lon))
+
+
+	@classmethod
+	def fromDicts(cls, ids, lat, lon, reflat=None):
+		"""
+		Method to create index from dictionaries of
+		coordinates by location id, e.g.
+		CapEx.customerLat and CapEx.customerLon.
+		"""
+		return cls(ids, [lat[locid] for locid in ids],
+			[lon[locid] for locid in ids], reflat)
+
+
+	def project(self, lat, lon):
+		"""
+		Method to project coordinates to plane in miles
+		"""
+		lat = np.asarray(lat, dtype=np.float64)
+		lon = np.asarray(lon, dtype=np.float64)
+		return np.stack([
+			lon * MILESPERDEGREE * np.cos(np.radians(self.reflat)),
+			lat * MILESPERDEGREE], axis=-1)
+
+
+	def slack(self, radius):
+		# widen projected radius to cover projection error
+		return radius * 1.01 + 1e-6
+
+
+	def knn(self, lat, lon, k):
+		"""
+		Method to find k nearest indexed locations of
+		query points.
+		args:
+			lat, lon: array like of query coordinates
+			k: int
+		return:
+			distance: array (queries x k) of great
+				circle distances in miles
+			index: array (queries x k) of indices
+				into ids
+		"""
+		k = min(k, len(self.ids))
+		lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+		lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+		_, index = self.tree.query(self.project(lat, lon), k=k)
+		index = index.reshape(len(lat), k)
+		distance = haversine(lat[:, None], lon[:, None],
+			self.lat[index], self.lon[index])
+
+		# reorder by great circle distance
+		order = np.argsort(distance, axis=1, kind='stable')
+		return np.take_along_axis(distance, order, axis=1), \
+			np.take_along_axis(index, order, axis=1)
+
+
+	def pairs(self, radius):
+		"""
+		Method to find all pairs of indexed locations
+		within radius miles (great circle) of each other.
+		return:
+			i, j: arrays of indices into ids with i < j,
+				sorted by i then j
+			distance: array of great circle distances
+		"""
+		pairs = self.tree.query_pairs(self.slack(radius),
+			output_type='ndarray')
+		if len(pairs) == 0:
+			empty = np.array([], dtype=np.intp)
+			return empty, empty, np.array([], dtype=np.float64)
+
+		i, j = np.minimum(pairs[:, 0], pairs[:, 1]), \
+			np.maximum(pairs[:, 0], pairs[:, 1])
+		distance = haversine(self.lat[i], self.lon[i],
+			self.lat[j], self.lon[j])
+		keep = distance <= radius
+		i, j, distance = i[keep], j[keep], distance[keep]
+
+		order = np.lexsort((j, i))
+		return i[order], j[order], distance[order]
+
+
+	def partition(self, parts):
+		"""
+		Method to split indexed locations into spatial 
+		tiles of about equal size (k-d split), by
+		repeatedly halving largest tile at median of
+		its wider projected axis.
+		return:
+			tile: array of tile number of every location
+		"""
+		points = self.project(self.lat, self.lon)
+		tiles = [np.arange(len(self.ids))]
+		while len(tiles) < parts:
+			largest = max(range(len(tiles)), key=lambda t: len(tiles[t]))
+			members = tiles[largest]
+			if len(members) < 2:
+				break
+
+			extent = np.ptp(points[members], axis=0)
+			axis = int(np.argmax(extent))
+			order = members[np.argsort(points[members, axis], kind='stable')]
+			half = len(order) // 2
+			tiles[largest:largest + 1] = [np.sort(order[:half]),
+				np.sort(order[half:])]
+
+		tile = np.empty(len(self.ids), dtype=np.intp)
+		for t, members in enumerate(tiles):
+			tile[members] = t
+		return tile
@@ -1,11 +1,15 @@
-from random import choice
+from collections import deque
+from random import choice, Random
+import time
+
+import numpy as np
 
 class TSPGraph:
 	"""
 	Class to create a directed graph.
 	"""
 
-	def __init__(self, vertices, edges=[]):
+	def __init__(self, vertices, edges=[], distmatrix=None):
 		"""
 		Initialize Graph object with vertices 
 		and (optional) directed edges
@@ -13,12 +17,32 @@ class TSPGraph:
 			vertices: List of nodes in graph
 			edges: (Optional) List of tuples where 
 				each tuple is format (u,v,w)
+			distmatrix: (Optional) square array of
+				edge weights between vertices in same
+				order. If given, no edges are stored,
+				graph nodes are integer indices into 
+				vertices and self.edges is the array.
+				Use labels to map tours back.
 		"""
-		self.nodes = vertices
+		self.vertices = vertices
 		self.n = len(vertices)
 
+		if distmatrix is not None:
+			self.nodes = list(range(self.n))
+			self.edges = np.asarray(distmatrix, dtype=np.float64)
+			if self.edges.shape != (self.n, self.n):
+				raise ValueError(
+					f"Distance matrix must be {self.n} x {self.n}"
+				)
+			# nested lists, fastest scalar lookup weight[u][v]
+			self.weight = self.edges.tolist()
+			self.adjacency = None
+			return
+
+		self.nodes = vertices
 		self.adjacency = {v: [] for v in self.nodes}
 		self.edges = {}
+		self.weight = {v: {} for v in self.nodes}
 
 		if len(edges) > 0:
 			for edge in edges:
@@ -30,6 +54,10 @@ class TSPGraph:
 		Method to add directed edge from 
 		vertex u to v with numeric weight w.
 		"""
+		if isinstance(self.edges, np.ndarray):
+			raise TypeError(
+				"Edges of distance matrix graph can not be added"
+			)
 		for node in [u, v]:
 			if self.adjacency.get(node) == None:
 				raise KeyError(
@@ -38,6 +66,7 @@ class TSPGraph:
 		if isinstance(w, int) or isinstance(w, float):
 			self.adjacency[u].append((v, w))
 			self.edges[(u, v)] = w
+			self.weight[u][v] = w
 
 		else:
 			raise TypeError(
@@ -46,29 +75,143 @@ class TSPGraph:
 
 
 
+class Tour:
+	"""
+	Class to hold a cycle for local search moves with
+	node positions, so successor and predecessor of a
+	node are O(1) and segments are reversed in place
+	(shorter side of the cycle) without copying tour.
+
+	Reversing the complement of a segment gives same
+	cycle traversed the other way, so a direction flag
+	is flipped instead. Logical positions (at) count 
+	from start node in current direction and match 
+	list based moves.
+	"""
+	def __init__(self, tour):
+		"""
+		args:
+			tour: List of nodes forming a cycle,
+				first node repeated at the end
+		"""
+		self.order = list(tour[:-1])
+		self.n = len(self.order)
+		self.start = self.order[0]
+		self.direction = 1
+
+		if all(isinstance(v, int) for v in self.order) and \
+		sorted(self.order) == list(range(self.n)):
+			# integer nodes (distance matrix graph)
+			self.pos = [0] * self.n
+		else:
+			self.pos = {}
+		for i, v in enumerate(self.order):
+			self.pos[v] = i
+
+
+	def at(self, k):
+		"""
+		Method to return node k steps from start
+		"""
+		return self.order[(self.pos[self.start] + k * self.direction) % self.n]
+
+
+	def succ(self, v):
+		return self.order[(self.pos[v] + self.direction) % self.n]
+
+
+	def pred(self, v):
+		return self.order[(self.pos[v] - self.direction) % self.n]
+
+
+	def reverse(self, a, b):
+		"""
+		Method to reverse path from node a to node b
+		(following successors) in place.
+		"""
+		if self.direction == 1:
+			i, j = self.pos[a], self.pos[b]
+		else:
+			i, j = self.pos[b], self.pos[a]
+
+		n = self.n
+		inner = (j - i) % n + 1
+		if 2 * inner > n:
+			# reverse shorter complement instead
+			i, j, inner = (j + 1) % n, (i - 1) % n, n - inner
+			self.direction = -self.direction
+
+		order, pos = self.order, self.pos
+		for s in range(inner // 2):
+			x, y = (i + s) % n, (j - s) % n
+			order[x], order[y] = order[y], order[x]
+			pos[order[x]], pos[order[y]] = x, y
+
+
+	def reverseAt(self, i, j):
+		"""
+		Method to reverse segment between logical
+		positions i and j (i <= j) in place.
+		"""
+		if i < j:
+			self.reverse(self.at(i), self.at(j))
+
+
+	def nodes(self):
+		"""
+		Method to return tour as list of nodes from
+		start, with start repeated at the end
+		"""
+		tour = [self.at(k) for k in range(self.n)]
+		tour.append(self.start)
+		return tour
+
+
+
 class TSP(TSPGraph):
 	"""
 	Class to initiate and solve instances
 	of Traveling Salesman Problem using
 	Greedy, 2OPT and 3OPT.
 	"""
-	def __init__(self, vertices, edges=[]):
+	def __init__(self, vertices, edges=[], distmatrix=None):
 		"""
 		Initialize graph object 
 		args:
 			vertices: List of nodes in graph
 			edges: (Optional) List of tuples where 
 				each tuple is format (u,v,w)
+			distmatrix: (Optional) square array of
+				edge weights (see TSPGraph)
 		"""
-		super().__init__(vertices, edges)
+		super().__init__(vertices, edges, distmatrix)
 		
 
+	def labels(self, tour):
+		"""
+		Method to map tour of integer nodes of a 
+		distance matrix graph back to vertices
+		"""
+		if isinstance(self.edges, np.ndarray):
+			return [self.vertices[v] for v in tour]
+		return tour
+
+
 	def sortAdjacency(self):
 		"""
 		Method to sort inplace outgoing edges out of each vertex
 		based on edge weight
 		"""
 
+		if isinstance(self.edges, np.ndarray):
+			# stable, ties in vertex order as for edge lists
+			order = np.argsort(self.edges, axis=1, kind='stable').tolist()
+			self.adjacency = {
+				v: [(u, self.weight[v][u]) for u in order[v] if u != v]
+				for v in self.nodes
+			}
+			return
+
 		# second argument of tuple 'e' is weight
 		self.adjacency = {
 			v: sorted(self.adjacency[v], key=lambda e: e[1])
@@ -242,6 +385,34 @@ class TSP(TSPGraph):
 
 		return newtour
 
+	@staticmethod
+	def moveThreeOPT(cycle, i, j, k, case):
+		"""
+		Method to apply move of swapEdgesThreeOPT to
+		Tour in place, as reversals of S1 = i+1..j
+		and S2 = j+1..k
+		"""
+		reverseAt = cycle.reverseAt
+		if case == 1:
+			reverseAt(i+1, k)
+		elif case == 2:
+			reverseAt(i+1, j)
+		elif case == 3:
+			reverseAt(j+1, k)
+		elif case == 4:
+			reverseAt(i+1, k)
+			reverseAt(i+1, i+k-j)
+		elif case == 5:
+			reverseAt(i+1, k)
+			reverseAt(k-j+i+1, k)
+		elif case == 6:
+			reverseAt(i+1, j)
+			reverseAt(j+1, k)
+		elif case == 7:
+			reverseAt(i+1, k)
+			reverseAt(i+1, i+k-j)
+			reverseAt(i+k-j+1, k)
+
 
 	def calculateTourLength(self, tour):
 		"""
@@ -254,10 +425,11 @@ class TSP(TSPGraph):
 				Length of tour. If any edges is 
 				missing, returns zero.
 		"""
+		weight = self.weight
 		tourlen = 0
 		for i in range(len(tour)-1):
 			try:
-				tourlen += self.edges[(tour[i], tour[i+1])]
+				tourlen += weight[tour[i]][tour[i+1]]
 			except KeyError:
 				print(f"({tour[i]}, {tour[i+1]}) edge is not part of graph")
 		return tourlen
@@ -279,33 +451,38 @@ class TSP(TSPGraph):
 			# no cycle possible
 			return tour, 0
 
+		weight = self.weight
 		# length of provided tour
 		tourlen = self.calculateTourLength(tour)
 		
 		# tracking improvemnt in tour
 		improved = True
 
+		cycle = Tour(tour)
+		at = cycle.at
+
 		while improved:
 			improved = False
 
 			for i in range(n):
 				for j in range(i+2, n-1):
+					ti, ti1, tj, tj1 = at(i), at(i+1), at(j), at(j+1)
 
-					a = self.edges[(tour[i],tour[i+1])]
-					b = self.edges[(tour[j], tour[j+1])]
-					c = self.edges[(tour[i], tour[j])]
-					d = self.edges[(tour[i+1], tour[j+1])]
+					a = weight[ti][ti1]
+					b = weight[tj][tj1]
+					c = weight[ti][tj]
+					d = weight[ti1][tj1]
 
 					# benefit from swapping i,i+1 and j,j+1
 					# with i,j and i+1,j+1
 					delta = - a - b +  c + d
 					if delta < 0:
 						#print(delta, i, j)
-						tour = TSP.swapEdgesTwoOPT(tour.copy(), i, j)
+						cycle.reverseAt(i+1, j)
 						tourlen += delta
 						improved = True
 
-		return tour, tourlen
+		return cycle.nodes(), tourlen
 
 
 	def threeOPT(self, tour):
@@ -324,12 +501,16 @@ class TSP(TSPGraph):
 			# no cycle possible
 			return [], 0
 
+		weight = self.weight
 		# length of provided tour
 		tourlen = self.calculateTourLength(tour)
 
 		# tracking improvemnt in tour
 		improved = True
 
+		cycle = Tour(tour)
+		at = cycle.at
+
 		while improved:
 
 			improved = False
@@ -337,51 +518,456 @@ class TSP(TSPGraph):
 				for j in range(i+2, n-1):
 					for k in range(j+2, n-2+(i>0)):
 						#print(i, j, k)
-						a, b = tour[i], tour[i+1]
-						c, d = tour[j], tour[j+1]
-						e, f = tour[k], tour[k+1]
+						a, b = at(i), at(i+1)
+						c, d = at(j), at(j+1)
+						e, f = at(k), at(k+1)
+						ab, cd, ef = weight[a][b], weight[c][d], weight[e][f]
 
 						# possible cases of removing three edges 
-						# and adding three
-						deltacase = {
-							1: self.edges[a,e] + self.edges[b,f] \
-								- self.edges[a,b] - self.edges[e,f],
+						# and adding three, first with most benefit
+						bestcase = 1
+						bestdelta = weight[a][e] + weight[b][f] - ab - ef
+
+						delta = weight[a][c] + weight[b][d] - ab - cd
+						if delta < bestdelta:
+							bestcase, bestdelta = 2, delta
+						delta = weight[c][e] + weight[d][f] - cd - ef
+						if delta < bestdelta:
+							bestcase, bestdelta = 3, delta
+						delta = weight[a][d] + weight[e][c] + weight[b][f] \
+							- ab - cd - ef
+						if delta < bestdelta:
+							bestcase, bestdelta = 4, delta
+						delta = weight[a][e] + weight[d][b] + weight[c][f] \
+							- ab - cd - ef
+						if delta < bestdelta:
+							bestcase, bestdelta = 5, delta
+						delta = weight[a][c] + weight[b][e] + weight[d][f] \
+							- ab - cd - ef
+						if delta < bestdelta:
+							bestcase, bestdelta = 6, delta
+						delta = weight[a][d] + weight[e][b] + weight[c][f] \
+							- ab - cd - ef
+						if delta < bestdelta:
+							bestcase, bestdelta = 7, delta
+
+						if round(bestdelta, 3) < 0:
+							TSP.moveThreeOPT(cycle, i, j, k, bestcase)
+							tourlen += bestdelta
+							improved = True
 
-							2: self.edges[a,c] + self.edges[b,d] \
-								- self.edges[a,b] - self.edges[c,d],
+		return cycle.nodes(), tourlen
 
-							3: self.edges[c,e] + self.edges[d,f] \
-								- self.edges[c,d] - self.edges[e,f],
 
-							4: self.edges[a,d] + self.edges[e,c] + self.edges[b,f]\
-								- self.edges[a,b] - self.edges[c,d] - self.edges[e,f],
+	def heldKarp(self, startnode=None):
+		"""
+		Method to find optimal tour with Held-Karp
+		dynamic program over subsets of nodes (bit
+		masks), vectorized with NumPy over all subsets
+		of same size. Time and memory grow as 2^n n^2,
+		meant for up to about 13 nodes.
+		args:
+			startnode(optional): node tour starts and
+				ends at, first node if not specified
+		return:
+			tour: List of nodes forming a cycle
+			tourlen: int/float
+				Length of optimal tour
+		"""
+		start = self.nodes[0] if startnode is None else startnode
+		others = [v for v in self.nodes if v != start]
+		m = len(others)
+		if m == 0:
+			return [start, start], 0
+
+		order = [start] + others
+		if isinstance(self.edges, np.ndarray):
+			dist = self.edges[np.ix_(order, order)]
+		else:
+			dist = np.array([[0 if u == v else self.weight[u][v] 
+				for v in order] for u in order], dtype=np.float64)
+
+		# cost[mask, j]: shortest path from start through
+		# nodes of mask ending at others[j]
+		full = 1 << m
+		bit = 1 << np.arange(m)
+		inmask = (np.arange(full)[:, None] & bit[None, :]) != 0
+		size = inmask.sum(axis=1)
+		cost = np.full((full, m), np.inf)
+		parent = np.full((full, m), -1, dtype=np.intp)
+		cost[bit, np.arange(m)] = dist[0, 1:]
+
+		# arcs[j, i] = dist from others[i] to others[j]
+		arcs = dist[1:, 1:].T
+		for s in range(2, m + 1):
+			masks = np.nonzero(size == s)[0]
+			previous = masks[:, None] ^ bit[None, :]
+			candidates = cost[previous] + arcs[None, :, :]
+			best = np.argmin(candidates, axis=2)
+			values = np.take_along_axis(candidates, best[:, :, None], 
+				axis=2)[:, :, 0]
+			valid = inmask[masks]
+			cost[masks] = np.where(valid, values, np.inf)
+			parent[masks] = np.where(valid, best, -1)
+
+		j = int(np.argmin(cost[full - 1] + dist[1:, 0]))
+		mask, path = full - 1, []
+		while j >= 0:
+			path.append(others[j])
+			mask, j = mask ^ (1 << j), int(parent[mask, j])
+
+		tour = [start] + path[::-1] + [start]
+		return tour, self.calculateTourLength(tour)
+
+
+	def neighborLists(self, k):
+		"""
+		Method to return k nearest (lowest outgoing 
+		edge weight) neighbors of every vertex
+		"""
+		self.sortAdjacency()
+		return {v: [u for u, w in self.adjacency[v][:k]] 
+			for v in self.nodes}
 
-							5: self.edges[a,e] + self.edges[d,b] + self.edges[c,f]\
-								- self.edges[a,b] - self.edges[c,d] - self.edges[e,f],
 
-							6: self.edges[a,c] + self.edges[b,e] + self.edges[d,f]\
-								- self.edges[a,b] - self.edges[c,d] - self.edges[e,f],
+	def localSearch(self, tour, k=8, oropt=True):
+		"""
+		Method to improve tour with 2OPT and Or-opt 
+		(moving segments of up to three nodes, the 
+		segment insertion cases of 3OPT) moves, only
+		trying new edges to k nearest neighbors of a
+		node and skipping nodes whose neighborhood did
+		not change since last failed try (don't look
+		bits). A pass is about linear in tour size,
+		instead of cubic for threeOPT. Assumes 
+		symmetric edge weights, as twoOPT does.
+		args:
+			tour: List of nodes forming a cycle
+			k: int
+				Size of neighbor lists
+			oropt: boolean
+				If false, only 2OPT moves are tried
+		return:
+			tour: List of nodes forming a cycle,
+				starting and ending at first node
+				of provided tour
+			tourlen: int/float
+				Length of tour
+		"""
+		n = len(tour) - 1
+		if n <= 3:
+			# any cycle is optimal
+			return tour, self.calculateTourLength(tour)
+
+		weight = self.weight
+		neighbors = self.neighborLists(k)
+		cycle = Tour(tour)
+		succ, pred, reverse = cycle.succ, cycle.pred, cycle.reverse
+
+		def moveSegment(first, last, x, forward):
+			# move segment first..last between x and its
+			# successor by swapping it with block q..x that
+			# follows it, first next to x if forward
+			q = succ(last)
+			reverse(first, x)
+			reverse(x, q)
+			if forward:
+				reverse(last, first)
+
+		def twoOptMove(a):
+			for forward in [True, False]:
+				b = succ(a) if forward else pred(a)
+				dab = weight[a][b]
+				for c in neighbors[a]:
+					dac = weight[a][c]
+					if dac >= dab:
+						break
+					d = succ(c) if forward else pred(c)
+					if c == b or d == a:
+						continue
+					delta = dac + weight[b][d] - dab - weight[c][d]
+					if delta < -1e-9:
+						if forward:
+							reverse(b, c)
+						else:
+							reverse(a, d)
+						return [a, b, c, d]
+			return None
+
+		def orOptMove(a):
+			for length in range(1, 4):
+				if length + 2 >= n:
+					break
+				# segments starting and ending at a
+				first = a
+				for _ in range(length - 1):
+					first = pred(first)
+				for first in [a, first]:
+					segment = [first]
+					for _ in range(length - 1):
+						segment.append(succ(segment[-1]))
+					last = segment[-1]
+					other = last if a == first else first
+					p, q = pred(first), succ(last)
+					gain = weight[p][first] + weight[last][q] - weight[p][q]
+					members = set(segment)
+
+					for c in neighbors[a]:
+						dac = weight[a][c]
+						if dac >= gain:
+							break
+						if c in members:
+							continue
+
+						# between c and its successor, a next to c
+						y = succ(c)
+						if c != p and y not in members:
+							delta = dac + weight[other][y] - weight[c][y] - gain
+							if delta < -1e-9:
+								moveSegment(first, last, c, a == first)
+								return [p, q, c, y] + segment
+
+						# between c and its predecessor, a next to c
+						x = pred(c)
+						if c != q and x not in members:
+							delta = weight[x][other] + dac - weight[x][c] - gain
+							if delta < -1e-9:
+								moveSegment(first, last, x, a == last)
+								return [p, q, x, c] + segment
+			return None
+
+		# nodes with don't look bit off
+		queue = deque(tour[:-1])
+		dontlook = {v: False for v in tour[:-1]}
+
+		while queue:
+			a = queue.popleft()
+			dontlook[a] = True
+
+			changed = twoOptMove(a)
+			if changed is None and oropt:
+				changed = orOptMove(a)
+
+			if changed is not None:
+				for v in changed:
+					if dontlook[v]:
+						dontlook[v] = False
+						queue.append(v)
+
+		tour = cycle.nodes()
+		return tour, self.calculateTourLength(tour)
+
+
+	def linKernighan(self, tour, k=8, maxdepth=6, timelimit=None, 
+	maxiterations=None, oropt=True):
+		"""
+		Method to improve tour with Lin-Kernighan style
+		variable depth search. From a node t1, edge
+		(t1, t2) is broken and a chain of 2OPT moves
+		follows, each adding an edge from current t2 to
+		one of its k nearest neighbors t3 and breaking
+		(t3, t4). Chain is kept up to the step with best
+		closed tour gain and undone beyond it. Edges 
+		added in a chain are never broken in it. Nodes
+		are tried with don't look bits, in both tour
+		directions, and converged tours are polished 
+		with localSearch (2OPT and Or-opt) while it
+		improves. Assumes symmetric edge weights.
+		args:
+			tour: List of nodes forming a cycle
+			k: int
+				Size of neighbor lists
+			maxdepth: int
+				Max 2OPT moves in one chain
+			timelimit: float (optional)
+				Seconds after which search stops
+			maxiterations: int (optional)
+				Max number of chains started
+			oropt: boolean
+				If false, no Or-opt polishing
+		return:
+			tour: List of nodes forming a cycle,
+				starting and ending at first node
+				of provided tour
+			tourlen: int/float
+				Length of tour
+		"""
+		n = len(tour) - 1
+		if n <= 3:
+			# any cycle is optimal
+			return tour, self.calculateTourLength(tour)
+
+		starttime = time.time()
+		weight = self.weight
+		neighbors = self.neighborLists(k)
+		iterations = 0
+
+		def stop():
+			return (timelimit is not None and \
+				time.time() - starttime > timelimit) or \
+				(maxiterations is not None and iterations >= maxiterations)
+
+		def chain(cycle, t1):
+			# returns nodes of kept moves, or None
+			succ, pred, reverse = cycle.succ, cycle.pred, cycle.reverse
+			t2 = succ(t1)
+			gain = weight[t1][t2]
+			moves, added = [], set()
+			best, bestdepth = 1e-9, 0
+
+			for _ in range(maxdepth):
+				# next step with best lookahead gain
+				step, steplookahead = None, None
+				for t3 in neighbors[t2]:
+					g = gain - weight[t2][t3]
+					if g <= 0:
+						break
+					t4 = pred(t3)
+					if t3 == t1 or t4 == t2 or (t3, t4) in added:
+						continue
+					lookahead = g + weight[t3][t4]
+					if step is None or lookahead > steplookahead:
+						step, steplookahead = (t3, t4), lookahead
+				if step is None:
+					break
+
+				t3, t4 = step
+				reverse(t2, t4)
+				moves.append((t2, t3, t4))
+				added.add((t2, t3))
+				added.add((t3, t2))
+				gain = steplookahead
+
+				closed = gain - weight[t4][t1]
+				if closed > best:
+					best, bestdepth = closed, len(moves)
+				t2 = t4
+
+			# undo moves after best closed tour
+			while len(moves) > bestdepth:
+				t2, t3, t4 = moves.pop()
+				reverse(t4, t2)
+
+			if bestdepth == 0:
+				return None
+			return [t1] + [v for move in moves for v in move]
 
-							7: self.edges[a,d] + self.edges[e,b] + self.edges[c,f]\
-								- self.edges[a,b] - self.edges[c,d] - self.edges[e,f],
-						}
+		tourlen = self.calculateTourLength(tour)
+		while True:
+			cycle = Tour(tour)
+			queue = deque(tour[:-1])
+			dontlook = {v: False for v in tour[:-1]}
+
+			while queue and not stop():
+				t1 = queue.popleft()
+				dontlook[t1] = True
+				iterations += 1
+
+				changed = None
+				for _ in range(2):
+					# second try in other tour direction
+					cycle.direction = -cycle.direction
+					changed = chain(cycle, t1)
+					if changed is not None:
+						break
+
+				if changed is not None:
+					for v in changed:
+						if dontlook[v]:
+							dontlook[v] = False
+							queue.append(v)
+
+			tour = cycle.nodes()
+			newlen = self.calculateTourLength(tour)
+			if not oropt or stop():
+				return tour, newlen
+
+			tour, newlen = self.localSearch(tour, k)
+			if newlen >= tourlen - 1e-9:
+				return tour, newlen
+			tourlen = newlen
+
+
+
+def test(instances=20, seed=0):
+	"""
+	Function to check in place 3OPT moves on Tour
+	against list based swapEdgesThreeOPT, move by
+	move and for full threeOPT runs, on random
+	instances. Raises AssertionError on mismatch.
+	"""
+	rnd = Random(seed)
 
-						# get the case with most benefit
+	def listThreeOPT(tsp, tour):
+		# list based 3OPT with swapEdgesThreeOPT
+		n = len(tour)
+		weight = tsp.weight
+		tourlen = tsp.calculateTourLength(tour)
+		improved = True
+		while improved:
+			improved = False
+			for i in range(n):
+				for j in range(i+2, n-1):
+					for k in range(j+2, n-2+(i>0)):
+						a, b = tour[i], tour[i+1]
+						c, d = tour[j], tour[j+1]
+						e, f = tour[k], tour[k+1]
+						ab, cd, ef = weight[a][b], weight[c][d], weight[e][f]
+						deltacase = {
+							1: weight[a][e] + weight[b][f] - ab - ef,
+							2: weight[a][c] + weight[b][d] - ab - cd,
+							3: weight[c][e] + weight[d][f] - cd - ef,
+							4: weight[a][d] + weight[e][c] + weight[b][f] \
+								- ab - cd - ef,
+							5: weight[a][e] + weight[d][b] + weight[c][f] \
+								- ab - cd - ef,
+							6: weight[a][c] + weight[b][e] + weight[d][f] \
+								- ab - cd - ef,
+							7: weight[a][d] + weight[e][b] + weight[c][f] \
+								- ab - cd - ef,
+						}
 						bestcase = min(deltacase, key=deltacase.get)
-
 						if round(deltacase[bestcase], 3) < 0:
-							#print(round(deltacase[bestcase], 3), i, j, k, bestcase)
-							tour = TSP.swapEdgesThreeOPT(tour.copy(), i, j, k, case=bestcase)
-							#print(self.calculateTourLength(tour), tourlen + deltacase[bestcase])
+							tour = TSP.swapEdgesThreeOPT(tour, i, j, k, bestcase)
 							tourlen += deltacase[bestcase]
 							improved = True
-
 		return tour, tourlen
 
+	for _ in range(instances):
+		nstops = rnd.randint(6, 25)
+		tour = list(range(nstops))
+		rnd.shuffle(tour)
+		tour.append(tour[0])
+
+		# every case at random valid positions
+		n = len(tour)
+		cycle, listtour = Tour(tour), list(tour)
+		for _ in range(100):
+			i = rnd.randrange(0, n-5)
+			j = rnd.randrange(i+2, n-3)
+			if j+2 >= n-2+(i>0):
+				continue
+			k = rnd.randrange(j+2, n-2+(i>0))
+			case = rnd.randint(1, 7)
+			TSP.moveThreeOPT(cycle, i, j, k, case)
+			listtour = TSP.swapEdgesThreeOPT(listtour, i, j, k, case)
+			assert cycle.nodes() == listtour, (i, j, k, case)
+
+		# full runs from same start tour
+		points = np.array([[rnd.random(), rnd.random()] 
+			for _ in range(nstops)])
+		distmatrix = np.round(np.sqrt(((points[:, None] 
+			- points[None, :])**2).sum(axis=2)) * 10, 2)
+		tsp = TSP(list(range(nstops)), distmatrix=distmatrix)
+		result, resultlen = tsp.threeOPT(tour)
+		expected, expectedlen = listThreeOPT(tsp, tour)
+		assert result == expected
+		assert abs(resultlen - expectedlen) < 1e-6
+	print(f"threeOPT matched list based swaps on {instances} instances")
 
 
 if __name__ == '__main__':
-	pass
+	test()
 
 
 